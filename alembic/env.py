@@ -0,0 +1,48 @@
+# Environment of the migrations: connects to the database of the .env file (the sync psycopg2 url)
+# and compares the database with our models for "alembic revision --autogenerate"
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+from app import models
+from app.database import SQLALCHEMY_DB_URL
+
+config = context.config
+if config.config_file_name is not None:
+    # keep the loggers of the app (e.g. the slow-query log) working
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+# a url given by the caller (e.g. the tests) wins over the .env file
+# (% has to be escaped, the ini values are interpolated)
+if not config.get_main_option("sqlalchemy.url"):
+    config.set_main_option("sqlalchemy.url", SQLALCHEMY_DB_URL.replace("%", "%%"))
+
+target_metadata = models.Base.metadata
+
+
+# The GIN index of the search is created with raw DDL (see models.py), the models do not know it,
+# so autogenerate must not try to drop it
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == "index" and name == "ix_posts_search")
+
+
+# alembic upgrade head --sql: prints the SQL instead of running it
+def run_migrations_offline():
+    context.configure(url=config.get_main_option("sqlalchemy.url"), target_metadata=target_metadata,
+                      literal_binds=True, dialect_opts={"paramstyle": "named"}, include_object=include_object)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = engine_from_config(config.get_section(config.config_ini_section),
+                                     prefix="sqlalchemy.", poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata,
+                          include_object=include_object)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
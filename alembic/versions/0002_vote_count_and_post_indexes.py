@@ -0,0 +1,43 @@
+"""vote count of the posts, indexes of the keyset pagination and of the full-text search
+
+posts.vote_count: the number of votes of every post, filled from the votes already cast
+(one pass over the votes grouped by post, the posts without votes keep the default 0)
+ix_posts_created_at_id: the keyset pagination of GET /posts walks the posts ordered by (created_at, id)
+ix_posts_search: the GIN index of the full-text search (Postgres only, see models.py)
+
+The indexes are built CONCURRENTLY on Postgres, like in 0003
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('vote_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("UPDATE posts SET vote_count = counts.votes "
+               "FROM (SELECT post_id, count(*) AS votes FROM votes GROUP BY post_id) AS counts "
+               "WHERE posts.id = counts.post_id")
+
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'], postgresql_concurrently=postgresql)
+        if postgresql:
+            op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_search ON posts "
+                       "USING gin (to_tsvector('english', title || ' ' || content))")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_posts_search")
+    op.drop_index('ix_posts_created_at_id', table_name='posts')
+    op.drop_column('posts', 'vote_count')
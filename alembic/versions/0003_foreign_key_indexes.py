@@ -0,0 +1,35 @@
+"""index the foreign keys used by the joins and filters of the routers
+
+posts.owner_id: the owner of every post is joined (joinedload/selectinload of Post.owner)
+and the posts of a user are looked up by it
+votes.post_id: the primary key (user_id, post_id) can not find the votes of a post on its own
+posts.created_at is already served by ix_posts_created_at_id of 0002 (created_at is its first column)
+
+Postgres builds the indexes CONCURRENTLY, so the tables are not locked against writes meanwhile
+(this can not run in a transaction, hence the autocommit block)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_owner_id', 'posts', ['owner_id'], postgresql_concurrently=concurrently)
+        op.create_index('ix_votes_post_id', 'votes', ['post_id'], postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    op.drop_index('ix_votes_post_id', table_name='votes')
+    op.drop_index('ix_posts_owner_id', table_name='posts')
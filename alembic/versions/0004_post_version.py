@@ -0,0 +1,27 @@
+"""version of the posts, for the ETags and the optimistic concurrency of the edits
+
+Every existing post starts at version 1
+(a column with a constant default is added without rewriting the table on Postgres 11+)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('posts', 'version')
@@ -0,0 +1,62 @@
+"""follows and the precomputed timelines of the feed
+
+users.follower_count: the accounts with many followers are pulled by the feed instead of fanned out
+follows: who follows whom, indexed by followed_id for the fan-out
+timelines: the posts in the feed of every user, indexed by post_id for the cascade of a deleted post
+ix_posts_owner_id_id replaces ix_posts_owner_id: the latest posts of a user, newest first
+(built CONCURRENTLY on Postgres before the old one is dropped, like in 0003)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_table(
+        'follows',
+        sa.Column('follower_id', sa.Integer(), nullable=False),
+        sa.Column('followed_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['followed_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('follower_id', 'followed_id'),
+    )
+    op.create_index('ix_follows_followed_id', 'follows', ['followed_id'])
+    op.create_table(
+        'timelines',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'post_id'),
+    )
+    op.create_index('ix_timelines_post_id', 'timelines', ['post_id'])
+
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_follower_count', 'users', ['follower_count'], postgresql_concurrently=concurrently)
+        op.create_index('ix_posts_owner_id_id', 'posts', ['owner_id', 'id'], postgresql_concurrently=concurrently)
+        op.drop_index('ix_posts_owner_id', table_name='posts', postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    op.create_index('ix_posts_owner_id', 'posts', ['owner_id'])
+    op.drop_index('ix_posts_owner_id_id', table_name='posts')
+    op.drop_index('ix_users_follower_count', table_name='users')
+    op.drop_index('ix_timelines_post_id', table_name='timelines')
+    op.drop_table('timelines')
+    op.drop_index('ix_follows_followed_id', table_name='follows')
+    op.drop_table('follows')
+    op.drop_column('users', 'follower_count')
@@ -8,7 +8,8 @@ from . import models        # . represents our current directory
 from .database import engine, get_db
 
 
-models.Base.metadata.create_all(bind=engine)
+# The tables are created by the migrations (alembic upgrade head), not at import
+# models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
 
@@ -0,0 +1,58 @@
+# Small in-process cache, used to avoid going to the database (or redoing some work)
+# for values that are asked for again and again
+# It is bounded: when it is full, the least recently used entry is thrown away (LRU)
+# and every entry expires after ttl seconds
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()      # key -> (expires_at, value), least recently used first
+        # the sync mode runs the handlers in the threadpool, so the cache can be used from several threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # returns the cached value, or None if the key is not in the cache (or expired)
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # ttl can be given to expire this entry earlier (or later) than the other ones
+    def set(self, key, value, ttl: float = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0}
@@ -0,0 +1,137 @@
+# Compression of the responses (brotli or gzip, whichever the client prefers in Accept-Encoding)
+# JSON compresses very well: a page of posts shrinks to a fraction of its size, which matters far more
+# to a mobile client than the time spent compressing it
+# - responses smaller than compression_minimum_size are sent as they are (not worth the CPU and the headers)
+# - streamed responses (the exports) are compressed chunk by chunk, every chunk is flushed so the client
+#   still gets the rows as they come
+# - only text-like content (JSON, NDJSON, CSV, text) is compressed, and never twice
+# - the ETag of a compressed response becomes weak: the bytes are not the ones the strong tag stands for
+#   (a conditional GET still matches it, and If-Match still accepts it: only the version in it is compared,
+#   see utils.if_match_versions)
+# brotli is an optional dependency (pip install Brotli): without it only gzip is offered
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        # wbits 31: the gzip format (header and checksum) instead of raw zlib
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        return self._compressor.process(data) + (self._compressor.finish() if last else self._compressor.flush())
+
+
+# the encoding to use for an Accept-Encoding header ("br", "gzip" or None), the highest q-value wins,
+# brotli first when they are equal
+def choose_encoding(accept_encoding: str):
+    available = ("br", "gzip") if brotli is not None else ("gzip",)
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, *params = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[name.lower()] = q
+    best, best_q = None, 0.0
+    for name in available:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1000, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def encoder(self, name: str):
+        return BrotliEncoder(self.brotli_quality) if name == "br" else GzipEncoder(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http" and self.minimum_size >= 0:
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None        # the start of the response, held back until it is known whether to compress
+        buffered = []       # the first chunks of the body, until there is enough of it to decide
+        size = 0
+        encoder = None
+
+        async def send_compressed(message):
+            nonlocal start, size, encoder
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                length = headers.get("content-length")
+                if "content-encoding" in headers or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES) \
+                        or (length is not None and int(length) < self.minimum_size):
+                    await send(message)
+                else:
+                    start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                # sent as it is, or the rest of a compressed body
+                if encoder is not None and message["type"] == "http.response.body":
+                    more_body = message.get("more_body", False)
+                    message = {"type": "http.response.body", "more_body": more_body,
+                               "body": encoder.compress(message.get("body", b""), not more_body)}
+                await send(message)
+                return
+
+            # (a body can come in many chunks, e.g. a StreamingResponse, even a small one)
+            more_body = message.get("more_body", False)
+            buffered.append(message.get("body", b""))
+            size += len(buffered[-1])
+            if more_body and size < self.minimum_size:
+                return
+            body = b"".join(buffered)
+            buffered.clear()
+            headers = MutableHeaders(raw=start["headers"])
+            if size >= self.minimum_size:
+                encoder = self.encoder(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                body = encoder.compress(body, not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+            await send(start)
+            start = None
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def compression_options():
+    return {"minimum_size": settings.compression_minimum_size, "gzip_level": settings.gzip_level,
+            "brotli_quality": settings.brotli_quality}
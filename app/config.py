@@ -14,6 +14,86 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
+    # True: use the async (asyncpg) engine and session
+    # False: fall back to the sync (psycopg2) session, run in the threadpool
+    database_async: bool = True
+    # read replicas (see replicas.py): "host:port" of every replica, comma separated
+    # (same username, password and database name as the primary), empty: everything is read from the primary
+    database_replicas: str = ""
+    # a replica further behind the primary than this is not read from
+    replica_max_lag_seconds: float = 5
+    # how often the lag of a replica is checked
+    replica_check_seconds: float = 5
+    # how long the reads of a client go to the primary after it wrote something (read-your-writes)
+    replica_sticky_seconds: float = 10
+    # connection pool of the database (per engine)
+    db_pool_size: int = 5
+    # connections opened on top of the pool size in a burst (closed again when given back)
+    db_max_overflow: int = 10
+    # seconds to wait for a free connection before giving up
+    db_pool_timeout: float = 30
+    # connections older than this (seconds) are replaced, -1 to keep them forever
+    db_pool_recycle: int = 1800
+    # check that a connection is still alive before using it
+    db_pool_pre_ping: bool = True
+    # cache of the logged in users (see auth.py), 0 to switch it off
+    user_cache_size: int = 10000
+    user_cache_ttl_seconds: int = 60
+    # cache of the verified access tokens (see auth.py), 0 to switch it off
+    token_cache_size: int = 10000
+    # cache of the post responses (see response_cache.py): "memory", "redis" or "none"
+    response_cache_backend: str = "memory"
+    response_cache_size: int = 10000
+    # also the longest time a cached response can be stale
+    response_cache_ttl_seconds: int = 10
+    redis_url: str = "redis://localhost:6379/0"
+    # token for the /internal endpoints (X-Admin-Token header), empty: no access at all
+    admin_token: str = ""
+    # vote buffer (see votes.py): the votes are written together every vote_buffer_ms, 0 to write each vote
+    # right away; a batch is also written as soon as vote_buffer_size votes are waiting
+    vote_buffer_ms: float = 0
+    vote_buffer_size: int = 500
+    # rate limiting (see ratelimit.py): "memory", "redis" (shared by the workers, at redis_url) or "none"
+    rate_limit_backend: str = "memory"
+    # budget of every client per route, "route=requests/seconds", "*" for the other routes
+    rate_limits: str = ("POST /login=10/60,POST /users=10/60,GET /posts/search=60/60,"
+                        "GET /posts?search_keyword=60/60,GET /export/users=5/60,GET /export/posts=5/60,*=600/60")
+    # most buckets kept by the memory backend
+    rate_limit_memory_keys: int = 100000
+    # load shedding: requests allowed to wait for a database connection on top of the pool size and overflow,
+    # the next ones get a 503 right away (-1 to never shed)
+    load_shed_queue: int = 50
+    # compression of the responses (see compression.py): smaller ones are sent as they are, -1 to never compress
+    compression_minimum_size: int = 1000
+    gzip_level: int = 6
+    # brotli 11 is far too slow for responses made on the fly
+    brotli_quality: int = 4
+    # follow feed (see feed.py): the posts of the accounts with at least this many followers are not written into
+    # the timelines of their followers, the feed pulls them when it is read
+    feed_pull_followers: int = 10000
+    # latest posts of an account copied into the timeline of a new follower
+    feed_backfill_posts: int = 20
+    # most items in one bulk request (POST /posts/bulk, POST /votes/batch)
+    bulk_max_items: int = 1000
+    # rows fetched from the database at a time by the exports
+    export_batch_size: int = 1000
+    # slow-query log (see slow_queries.py)
+    slow_query_threshold_ms: float = 200
+    # share of the slow SELECTs whose plan is captured with EXPLAIN (ANALYZE, BUFFERS), 0 to never do it
+    slow_query_explain_sample_rate: float = 0.0
+    # how many slow queries are kept for GET /internal/slow-queries
+    slow_query_buffer_size: int = 100
+    # profiling of single requests (see profiling.py)
+    # share of the requests profiled without being asked for, 0 to only profile on demand
+    profile_sample_rate: float = 0.0
+    profile_dir: str = "profiles"
+    profile_max_files: int = 50
+    # cost factor of bcrypt (changing it rehashes the passwords at the next login)
+    bcrypt_rounds: int = 12
+    # pool hashing/verifying the passwords (see utils.py): "thread" or "process"
+    password_executor: str = "thread"
+    password_workers: int = 4
+    password_queue_size: int = 16
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,128 @@
+# The follow feed (GET /feed, see routers/feed.py): the latest posts of the accounts a user follows
+#
+# Fan-out on write: every user has a precomputed timeline (the timelines table), one row per post of its feed
+# - a new post is written into the timelines of all the followers of its author (and of the author),
+#   in the same transaction as the post (create_posts, create_posts_bulk)
+# - a deleted post leaves all the timelines with it (ON DELETE CASCADE of timelines.post_id)
+# - following someone copies their latest feed_backfill_posts posts into the timeline,
+#   unfollowing removes their posts from it
+# A page of the feed is then one index range scan of the timeline (user_id, post_id), newest first:
+# it costs the same however many accounts the user follows
+#
+# Hybrid pull for the accounts with many followers (follower_count >= feed_pull_followers):
+# writing one post into millions of timelines would take far too long, so their posts are not fanned out,
+# and the feed pulls them when it is read instead: the latest posts of each followed "pulled" account
+# (one index range scan of (owner_id, id) each), merged with the page of the timeline
+# The pulled accounts of a user are found from the few accounts above the threshold (index on follower_count)
+# and the primary key of the follows, not by going through all the follows of the user
+# Note an account crossing the threshold keeps the posts already fanned out, an account falling back below it
+# is fanned out again from its next post (its posts in between are only in the feeds of the new followers)
+from sqlalchemy import delete, insert, literal, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload
+from fastapi import status
+from . import models
+from .config import settings
+
+FOLLOWED = "successfully followed"
+UNFOLLOWED = "successfully unfollowed"
+
+
+def _no_user(user_id: int):
+    return f'User {user_id} does not exist'
+
+
+def is_pulled(follower_count: int):
+    return follower_count >= settings.feed_pull_followers
+
+
+# Writes the new posts of author_id into the timelines: the author's own, and the ones of its followers
+# unless the author has too many of them (the posts are pulled instead)
+def fan_out(db: Session, author_id: int, post_ids):
+    own = select(literal(author_id), models.Post.id).where(models.Post.id.in_(post_ids))
+    followers = select(models.Follow.follower_id, models.Post.id).join(
+        models.Post, models.Post.owner_id == models.Follow.followed_id).where(
+        models.Follow.followed_id == author_id, models.Post.id.in_(post_ids),
+        select(models.User.follower_count).where(models.User.id == author_id).scalar_subquery()
+        < settings.feed_pull_followers)
+    db.execute(insert(models.Timeline).from_select(
+        ["user_id", "post_id"], union_all(own, followers)))
+
+
+# returns (status code, detail)
+def follow(db: Session, follower_id: int, followed_id: int):
+    if follower_id == followed_id:
+        return status.HTTP_400_BAD_REQUEST, f'User {follower_id} can not follow themselves'
+    # the follow and the follower count in one statement, like a vote (see votes.py)
+    new_follow = pg_insert(models.Follow).from_select(
+        ["follower_id", "followed_id"],
+        select(literal(follower_id), models.User.id).where(models.User.id == followed_id)
+    ).on_conflict_do_nothing().returning(models.Follow.followed_id).cte("new_follow")
+    followed = db.execute(update(models.User).where(models.User.id.in_(select(new_follow.c.followed_id))).values(
+        follower_count=models.User.follower_count + 1).returning(models.User.follower_count).execution_options(
+        synchronize_session=False)).first()
+    if followed and not is_pulled(followed.follower_count):
+        # their latest posts, so the feed is not empty until they post again
+        latest = select(models.Post.id).where(models.Post.owner_id == followed_id).order_by(
+            models.Post.id.desc()).limit(settings.feed_backfill_posts).subquery()
+        db.execute(pg_insert(models.Timeline).from_select(
+            ["user_id", "post_id"], select(literal(follower_id), latest.c.id)).on_conflict_do_nothing())
+    db.commit()
+    if followed:
+        return status.HTTP_201_CREATED, FOLLOWED
+    if db.execute(select(models.User.id).where(models.User.id == followed_id)).first() is None:
+        return status.HTTP_404_NOT_FOUND, _no_user(followed_id)
+    return status.HTTP_409_CONFLICT, f'User {follower_id} already follows the user {followed_id}'
+
+
+# returns (status code, detail)
+def unfollow(db: Session, follower_id: int, followed_id: int):
+    old_follow = delete(models.Follow).where(
+        models.Follow.follower_id == follower_id, models.Follow.followed_id == followed_id
+    ).returning(models.Follow.followed_id).cte("old_follow")
+    unfollowed = db.execute(update(models.User).where(models.User.id.in_(select(old_follow.c.followed_id))).values(
+        follower_count=models.User.follower_count - 1).returning(models.User.id).execution_options(
+        synchronize_session=False)).first()
+    if unfollowed:
+        db.execute(delete(models.Timeline).where(
+            models.Timeline.user_id == follower_id,
+            models.Timeline.post_id.in_(select(models.Post.id).where(models.Post.owner_id == followed_id))
+        ).execution_options(synchronize_session=False))
+    db.commit()
+    if unfollowed:
+        return status.HTTP_204_NO_CONTENT, UNFOLLOWED
+    return status.HTTP_404_NOT_FOUND, f'User {follower_id} does not follow the user {followed_id}'
+
+
+# the followed accounts of user_id whose posts are pulled
+def pulled_accounts(db: Session, user_id: int):
+    return list(db.execute(select(models.Follow.followed_id).where(
+        models.Follow.follower_id == user_id,
+        models.Follow.followed_id.in_(select(models.User.id).where(
+            models.User.follower_count >= settings.feed_pull_followers)))).scalars())
+
+
+# A page of the feed of user_id, newest first, before the post `before` (None: the first page)
+# [(Post, votes)] like GET /posts
+def read_feed(db: Session, user_id: int, limit: int, before: int = None):
+    def page(query, post_id):
+        if before is not None:
+            query = query.filter(post_id < before)
+        return query.options(joinedload(models.Post.owner)).order_by(post_id.desc()).limit(limit).all()
+
+    posts = db.query(models.Post, models.Post.vote_count.label("votes"))
+    rows = page(posts.join(models.Timeline, models.Timeline.post_id == models.Post.id).filter(
+        models.Timeline.user_id == user_id), models.Timeline.post_id)
+
+    pulled = pulled_accounts(db, user_id)
+    if pulled:
+        # the latest posts of every pulled account (at most a page each), then the page of all of them
+        latest = [select(models.Post.id).where(models.Post.owner_id == account, *(
+            [models.Post.id < before] if before is not None else [])).order_by(
+            models.Post.id.desc()).limit(limit) for account in pulled]
+        pulled_rows = page(posts.filter(models.Post.id.in_(
+            union_all(*[select(query.subquery().c.id) for query in latest]))), models.Post.id)
+        # (a post of an account which crossed the threshold can be in both)
+        merged = {row.Post.id: row for row in rows + pulled_rows}
+        rows = [merged[post_id] for post_id in sorted(merged, reverse=True)[:limit]]
+    return rows
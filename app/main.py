@@ -2,8 +2,11 @@
 # To see the way SQL queries can be directly embedded in the python code,
 # see main backup file
 
-from fastapi import FastAPI, Response, status, HTTPException, Depends
+import math
+import time
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List
 from pydantic import BaseModel
 import psycopg2
@@ -12,30 +15,112 @@ from sqlalchemy.orm import Session
 # we get the schemas from the schemas.py file
 # . represents our current directory
 from . import models, schemas, utils
-from .database import engine, get_db
-from .routers import post, user, auth, vote
+from .database import get_db, count_queries
+from .routers import post, user, auth, vote, internal, export, metrics, feed
+from .metrics import request_metrics, route_of
+from . import profiling
+from .compression import CompressionMiddleware, compression_options
+from .ratelimit import rate_limiter, load_shedder, route_name
+from .votes import vote_buffer
 from .config import settings
 
 
-models.Base.metadata.create_all(bind=engine)
+# Instrumentation of every request (see metrics.py, served at /metrics):
+# latency, status code, SQL time and number of SQL queries by method and route, and the requests in progress
+# Every response also tells how many SQL queries were needed to answer the request (X-Query-Count header)
+# so that the tests can check that an endpoint does not run one query per row (N+1 queries)
+# The middlewares of the app are plain ASGI ones, like CompressionMiddleware: they pass every message of
+# the response on as it comes, so a streamed response (the exports) is never held in memory on its way out
+# (the "http" middlewares of this Starlette version copy the whole body through an unbounded queue)
+# The latency is the one of the whole response, body included; X-Query-Count counts the queries run
+# before the response starts
+class InstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
 
-app = FastAPI()
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_metrics.started()
+        start = time.perf_counter()
+        status_code = None
 
+        async def send_instrumented(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message["headers"],
+                                                  (b"x-query-count", str(counter.count).encode())]}
+            await send(message)
 
-# To allows CORS
-# these domains are allowed to talk to us
-origins = ["https://www.google.com",
-           "https://www.bing.com", "https://www.youtube.com"]
-# if you want all domains to talk to your API, your origins will be ["*"] (a wildcard)
-app.add_middleware(
-    CORSMiddleware,     # middleware is a function that runs before every request
-    # specify the origins or domains our API can talk to
-    allow_origins=origins,
-    allow_credentials=True,
-    # allow specific HTTP methods, like a domain can only do get request and not post or delete requests to our API
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+        with count_queries(Request(scope)) as counter:
+            try:
+                await self.app(scope, receive, send_instrumented)
+            except Exception:
+                status_code = None
+                raise
+            finally:
+                request = Request(scope)
+                request_metrics.finished(request.method, route_of(request), status_code,
+                                         time.perf_counter() - start, counter.seconds, counter.count)
+
+
+# Profiling of single requests on demand (see profiling.py)
+# The requests which are not profiled only pay for the check, and go straight on to the app
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiling.should_profile(Request(scope)):
+            await self.app(scope, receive, send)
+            return
+        await profiling.profile_request(self.app, scope, receive, send)
+
+
+# The client a request is counted for by the rate limiter: the user of a valid bearer token
+# (verified like auth.get_current_user does, from the token cache most of the time, no database),
+# otherwise the client IP (the one of the connection, so behind a proxy it needs --proxy-headers in uvicorn)
+def client_of(request: Request):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f'user:{auth.verify_access_token(token, ValueError()).id}'
+        except ValueError:
+            pass
+    return f'ip:{request.client.host if request.client else "unknown"}'
+
+
+# Rate limiting and load shedding (see ratelimit.py), before anything touches the database
+# The endpoints of the people running the API are never limited (they are needed the most under load)
+# A request counts as in progress until the last bytes of its response are sent
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(("/internal", "/metrics")):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        if rate_limiter.enabled:
+            wait = await rate_limiter.check(client_of(request), route_name(request))
+            if wait:
+                response = ORJSONResponse({"detail": "Too many requests"},
+                                          status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                          headers={"Retry-After": str(math.ceil(wait))})
+                await response(scope, receive, send)
+                return
+        if not load_shedder.start():
+            response = ORJSONResponse({"detail": "Overloaded, try again later"},
+                                      status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            load_shedder.finished()
 
 
 # This class is now written in schemas.py file
@@ -56,15 +141,59 @@ app.add_middleware(
 #     print(f'Error connecting to database: {err}')
 
 
-# We use these router objects to break our code
-# into seperate python files
-# When we get a HTTP request, we go down the list like we normally do
-# and this app object we first reference is app.include_router(...)
-# and in here it says to include everything from post.router
-# and so this request will go into the post.py file in router directory
-# and check for all the matches
-# and if it finds a match, it will respond like it normally does
-app.include_router(post.router)
-app.include_router(user.router)
-app.include_router(auth.router)
-app.include_router(vote.router)
+# App factory: builds the app without touching the database
+# The tables and indexes are created by the migrations (alembic upgrade head, see alembic/),
+# not by create_all at import, so importing the app (e.g. in the tests) does not need a database
+def create_app() -> FastAPI:
+    # orjson encodes the responses much faster than the stdlib json
+    app = FastAPI(default_response_class=ORJSONResponse)
+
+    # To allows CORS
+    # these domains are allowed to talk to us
+    origins = ["https://www.google.com",
+               "https://www.bing.com", "https://www.youtube.com"]
+    # if you want all domains to talk to your API, your origins will be ["*"] (a wildcard)
+    app.add_middleware(
+        CORSMiddleware,     # middleware is a function that runs before every request
+        # specify the origins or domains our API can talk to
+        allow_origins=origins,
+        allow_credentials=True,
+        # allow specific HTTP methods, like a domain can only do get request and not post or delete requests to our API
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # let the browsers read the cursor of the next page of posts
+        expose_headers=["X-Next-Cursor"],
+    )
+
+    # the middleware added last runs first
+    # (the limits after the instrumentation, so the refused requests are in the metrics too)
+    app.add_middleware(RateLimitMiddleware)
+    app.add_middleware(InstrumentationMiddleware)
+    app.add_middleware(ProfilingMiddleware)
+    # outermost: compresses whatever the app answers (see compression.py)
+    app.add_middleware(CompressionMiddleware, **compression_options())
+
+    # We use these router objects to break our code
+    # into seperate python files
+    # When we get a HTTP request, we go down the list like we normally do
+    # and this app object we first reference is app.include_router(...)
+    # and in here it says to include everything from post.router
+    # and so this request will go into the post.py file in router directory
+    # and check for all the matches
+    # and if it finds a match, it will respond like it normally does
+    app.include_router(post.router)
+    app.include_router(user.router)
+    app.include_router(auth.router)
+    app.include_router(vote.router)
+    app.include_router(feed.router)
+    app.include_router(internal.router)
+    app.include_router(export.router)
+    app.include_router(metrics.router)
+
+    # the votes still waiting in the vote buffer are written before the app stops
+    app.add_event_handler("shutdown", vote_buffer.flush)
+    return app
+
+
+# the app served by uvicorn (uvicorn app.main:app)
+app = create_app()
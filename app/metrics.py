@@ -0,0 +1,131 @@
+# Metrics of the API, served in the Prometheus text format at /metrics (see main.py)
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+
+# Histogram with fixed buckets (in seconds), like the Prometheus ones:
+# a value is counted in the first bucket whose upper bound is >= the value
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    # cumulative counts by upper bound, as in the Prometheus format
+    def snapshot(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+            running += bucket_count
+            cumulative[str(bound)] = running
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+# buckets for the number of SQL queries of a request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+# Metrics of the HTTP requests, by method and route (the path template, e.g. /posts/{id},
+# so that every post id does not get its own series)
+# Only touched from the event loop, so no locking besides the one of the histograms
+class RequestMetrics:
+    def __init__(self):
+        self.latency = defaultdict(Histogram)
+        self.sql_time = defaultdict(Histogram)
+        self.sql_queries = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.responses = defaultdict(int)       # (method, route, status) -> count
+        self.exceptions = defaultdict(int)      # (method, route) -> count of unhandled errors
+        self.in_progress = 0
+        self.max_in_progress = 0
+
+    def started(self):
+        self.in_progress += 1
+        self.max_in_progress = max(self.max_in_progress, self.in_progress)
+
+    # status is None when the handler raised an unhandled exception
+    def finished(self, method: str, route: str, status, seconds: float, sql_seconds: float, sql_queries: int):
+        self.in_progress -= 1
+        key = (method, route)
+        self.latency[key].observe(seconds)
+        self.sql_time[key].observe(sql_seconds)
+        self.sql_queries[key].observe(sql_queries)
+        if status is None:
+            self.exceptions[key] += 1
+        else:
+            self.responses[(method, route, status)] += 1
+
+
+request_metrics = RequestMetrics()
+
+
+# route template of the request (known once the request has gone through the router)
+_route_paths = {}
+
+
+def route_of(request):
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in _route_paths:
+        for route in request.app.routes:
+            _route_paths[getattr(route, "endpoint", None)] = route.path
+    return _route_paths.get(endpoint, "unmatched")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def _render_histogram(lines, name, histograms, label_names):
+    for key, histogram in histograms.items():
+        labels = dict(zip(label_names, key))
+        snapshot = histogram.snapshot()
+        for bound, count in snapshot["buckets"].items():
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {snapshot["sum"]}')
+        lines.append(f'{name}_count{_labels(**labels)} {snapshot["count"]}')
+
+
+# Everything in the Prometheus text format
+# extra: more metrics (pools, caches), {metric name: (type, help, [(labels dict, value), ...])}
+def render(metrics: RequestMetrics, extra: dict):
+    lines = ["# HELP http_requests_total Responses by method, route and status code",
+             "# TYPE http_requests_total counter"]
+    for (method, route, status), count in metrics.responses.items():
+        lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+    lines += ["# HELP http_request_exceptions_total Unhandled errors by method and route",
+              "# TYPE http_request_exceptions_total counter"]
+    for (method, route), count in metrics.exceptions.items():
+        lines.append(f'http_request_exceptions_total{_labels(method=method, route=route)} {count}')
+    lines += ["# HELP http_requests_in_progress Requests being handled right now",
+              "# TYPE http_requests_in_progress gauge",
+              f'http_requests_in_progress {metrics.in_progress}',
+              "# HELP http_requests_in_progress_max Most requests handled at the same time",
+              "# TYPE http_requests_in_progress_max gauge",
+              f'http_requests_in_progress_max {metrics.max_in_progress}']
+    for name, help, histograms in (
+            ("http_request_duration_seconds", "Latency of the requests", metrics.latency),
+            ("http_request_sql_duration_seconds", "Time spent in SQL queries per request", metrics.sql_time),
+            ("http_request_sql_queries", "Number of SQL queries per request", metrics.sql_queries)):
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+        _render_histogram(lines, name, histograms, ("method", "route"))
+    for name, (type, help, samples) in extra.items():
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(**labels)} {value}')
+    return "\n".join(lines) + "\n"
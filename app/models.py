@@ -1,9 +1,10 @@
 # Every model represents a table in our database
 from .database import Base
-# this is to use the server_default = text
-from sqlalchemy.sql.expression import text
+# this is to use the server_default = now() / true, written so that it works in Postgres and SQLite
+from sqlalchemy.sql.expression import true
+from sqlalchemy.sql.functions import func
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, ForeignKey, Index, DDL, event
 
 
 # Post is a model here
@@ -17,18 +18,45 @@ class Post(Base):       # all the model classes need to extend Base class
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     rating = Column(Integer, nullable=True)
-    published = Column(Boolean, nullable=False, server_default='True')
+    published = Column(Boolean, nullable=False, server_default=true())
     created_at = Column(TIMESTAMP(timezone=True),
-                        nullable=False, server_default=text('now()'))
+                        nullable=False, server_default=func.now())
     # Note in writing a foreign key, we pass the tablename (users) and not the class name (User)
+    # the posts of a user are looked up by owner_id (and Postgres does not index foreign keys),
+    # see ix_posts_owner_id_id below
     owner_id = Column(Integer, ForeignKey(
         "users.id", ondelete="CASCADE"), nullable=False)
+    # number of votes of the post, kept up to date by cast_vote (see vote.py)
+    # so reading a post does not need to count its votes
+    # if it ever drifts from the votes table, reconcile.py repairs it
+    vote_count = Column(Integer, nullable=False, server_default='0')
+    # version of the post, bumped by every edit (see update_post in post.py)
+    # the ETag of the post is made from it, so a client can edit a post only if nobody else did meanwhile
+    version = Column(Integer, nullable=False, server_default='1')
 
     # Automatically create another property for our post so that when we retireve a post,
     # it will fetch the user based on the owner_id
     # here I am referencing the class and not the table
     owner = relationship("User")
 
+    # The keyset pagination of GET /posts walks the posts ordered by (created_at, id)
+    # this composite index lets Postgres jump straight to the next page
+    # (it also serves any filter or sort on created_at alone, so there is no separate index for it)
+    # The latest posts of a user (the feed pulls them, see feed.py) are read from (owner_id, id)
+    # newest first, without sorting all the posts of the user (it also serves owner_id alone)
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_owner_id_id", "owner_id", "id"),
+    )
+
+
+# GIN index for the full-text search of the posts (see search.py)
+# It only exists in Postgres, so it is created with raw DDL when the posts table is created
+# (the migrations create it too, see alembic/versions)
+SEARCH_INDEX_DDL = ("CREATE INDEX IF NOT EXISTS ix_posts_search ON posts "
+                    "USING gin (to_tsvector('english', title || ' ' || content))")
+event.listen(Post.__table__, "after_create", DDL(SEARCH_INDEX_DDL).execute_if(dialect="postgresql"))
+
 
 # User is another model here
 class User(Base):
@@ -40,7 +68,10 @@ class User(Base):
     password = Column(String, nullable=False)
     name = Column(String, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True),
-                        nullable=False, server_default=text('now()'))
+                        nullable=False, server_default=func.now())
+    # number of followers, kept up to date by follow/unfollow (see feed.py)
+    # indexed: the accounts with the most followers are looked up by it (their posts are pulled by the feed)
+    follower_count = Column(Integer, nullable=False, server_default='0', index=True)
 
 
 # Model for our votes
@@ -49,5 +80,32 @@ class Vote(Base):
 
     user_id = Column(Integer, ForeignKey(
         "users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    # the primary key (user_id, post_id) can not find the votes of a post on its own,
+    # so post_id gets its own index (counting, deleting the votes of a post)
+    post_id = Column(Integer, ForeignKey(
+        "posts.id", ondelete="CASCADE"), primary_key=True, nullable=False, index=True)
+
+
+# follower_id follows followed_id (see feed.py)
+class Follow(Base):
+    __tablename__ = "follows"
+
+    follower_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    # the followers of a user are looked up when they post (fan-out), the primary key can not do it
+    followed_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True, nullable=False, index=True)
+    created_at = Column(TIMESTAMP(timezone=True),
+                        nullable=False, server_default=func.now())
+
+
+# The precomputed feed of every user: one row per post in the feed of user_id (see feed.py)
+# A page of the feed is read from the primary key (user_id, post_id) backwards
+class Timeline(Base):
+    __tablename__ = "timelines"
+
+    user_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    # a deleted post leaves all the timelines at once (ON DELETE CASCADE), which needs this index
     post_id = Column(Integer, ForeignKey(
-        "posts.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+        "posts.id", ondelete="CASCADE"), primary_key=True, nullable=False, index=True)
@@ -0,0 +1,65 @@
+# Connection pools of the engines (see database.py), with statistics
+# The checkout wait time can not be seen with the pool events (they only fire once a connection
+# has been handed out), so the pools are subclassed to time the wait for a connection
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from .metrics import Histogram
+
+
+class PoolStats:
+    def __init__(self):
+        self.wait_time = Histogram()
+        self.timeouts = 0
+
+
+class _InstrumentedPool:
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.wait_time.observe(time.perf_counter() - start)
+
+    # engine.dispose() replaces the pool by a new one, which carries on with the same statistics
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+# Settings of the pools, the same for all the engines
+def pool_options(settings):
+    return {"pool_size": settings.db_pool_size, "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout, "pool_recycle": settings.db_pool_recycle,
+            "pool_pre_ping": settings.db_pool_pre_ping}
+
+
+def instrument(engine):
+    engine.pool.stats = PoolStats()
+    return engine
+
+
+# Live statistics of the pool of an engine
+def pool_status(engine):
+    pool = engine.pool
+    return {"size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeouts": pool.stats.timeouts,
+            "wait_time_seconds": pool.stats.wait_time.snapshot()}
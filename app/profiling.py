@@ -0,0 +1,79 @@
+# On-demand profiling of single requests
+# A request is profiled (with cProfile) when:
+# - it has the X-Profile: 1 header together with a valid X-Admin-Token, or
+# - it is picked by the sampling (profile_sample_rate in the settings)
+# The pstats file is saved in profile_dir, named after the time, method and route of the request,
+# and only the newest profile_max_files files are kept
+# Look at a profile with: python -m pstats <file> (or turn it into a flamegraph with flameprof/snakeviz)
+#
+# Note cProfile profiles the thread, not the request: requests running at the same time on the event loop
+# show up in the profile too, and the queries run in the threadpool (sync mode) do not
+# Only one request is profiled at a time
+import cProfile
+import os
+import random
+import re
+import time
+from starlette.requests import Request
+from .config import settings
+from .metrics import route_of
+from .routers.auth import is_admin
+
+_profiling = False
+
+
+def should_profile(request):
+    if _profiling:
+        return False
+    if request.headers.get("x-profile") == "1" and is_admin(request.headers.get("x-admin-token")):
+        return True
+    return settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
+
+
+# Runs the request under the profiler, until the last bytes of its response are sent
+# The name of the profile is in the X-Profile-Id header of the response
+async def profile_request(app, scope, receive, send):
+    global _profiling
+    _profiling = True
+    profile = cProfile.Profile()
+    name = None
+
+    async def send_profiled(message):
+        nonlocal name
+        if message["type"] == "http.response.start":
+            # (the route is known once the request has gone through the router)
+            name = profile_name(Request(scope))
+            message = {**message, "headers": [*message["headers"], (b"x-profile-id", name.encode())]}
+        await send(message)
+
+    try:
+        profile.enable()
+        try:
+            await app(scope, receive, send_profiled)
+        finally:
+            profile.disable()
+    finally:
+        _profiling = False
+    if name is not None:
+        save_profile(profile, name)
+
+
+def profile_name(request):
+    route = re.sub(r"[^A-Za-z0-9]+", "_", route_of(request)).strip("_") or "root"
+    return f'{time.strftime("%Y%m%dT%H%M%S")}-{int(time.time() * 1000) % 1000:03d}-{request.method}-{route}.pstats'
+
+
+def save_profile(profile, name):
+    os.makedirs(settings.profile_dir, exist_ok=True)
+    profile.dump_stats(os.path.join(settings.profile_dir, name))
+    # bounded store: the oldest profiles go first
+    for old_name in list_profiles()[settings.profile_max_files:]:
+        os.remove(os.path.join(settings.profile_dir, old_name))
+    return name
+
+
+# newest first
+def list_profiles():
+    if not os.path.isdir(settings.profile_dir):
+        return []
+    return sorted((name for name in os.listdir(settings.profile_dir) if name.endswith(".pstats")), reverse=True)
@@ -0,0 +1,183 @@
+# Rate limiting and load shedding (the middleware is limit_requests in main.py)
+#
+# Rate limiting: every client has a token bucket per route, e.g. "POST /login=10/60" lets a client
+# send a burst of 10 logins, then one more every 6 seconds (the bucket refills at 10 per 60 seconds)
+# A request without a token left gets a 429 with a Retry-After header
+# - the client is the user of the bearer token (checked like auth.get_current_user does, without the
+#   database), or the client IP for the requests without a valid token
+# - the routes without their own budget share the "*" budget (per client)
+# - GET /posts with a search_keyword (a full scan of the titles) has its own budget,
+#   under the name "GET /posts?search_keyword"
+#
+# A bucket is stored as one number: the time it will be full again (the "theoretical arrival time" of
+# GCRA, the same thing as a token bucket), so a check is a single read and write of one key, and a key
+# can be dropped as soon as its bucket is full (a missing key is a full bucket)
+#
+# Backends (rate_limit_backend in the settings):
+# - "memory": per worker (with N workers a client gets up to N times the budget)
+# - "redis": shared by all the workers, the check is one Lua script so it is atomic
+# - "none": no rate limiting
+# When the backend fails (e.g. Redis is down) the request is let through: the limiter must not take
+# the API down with it
+#
+# Load shedding: when more requests are in progress than the database can serve (the connections of
+# the pool and its overflow) plus load_shed_queue waiting for one, the next requests get a 503 right away
+# instead of piling up until they time out waiting for a connection (and making everyone time out)
+import time
+from collections import namedtuple
+from starlette.routing import Match
+from .cache import TTLCache
+from .config import settings
+
+Limit = namedtuple("Limit", ["requests", "seconds"])
+
+
+# "POST /login=10/60,*=600/60" -> {"POST /login": Limit(10, 60), "*": Limit(600, 60)}
+def parse_limits(text: str):
+    limits = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        route, _, budget = part.rpartition("=")
+        requests, _, seconds = budget.partition("/")
+        limits[route.strip()] = Limit(int(requests), float(seconds or 1))
+    return limits
+
+
+# GCRA: returns (the new time the bucket is full, 0) when the request can go,
+# or (the unchanged time, seconds to wait) when it has to wait
+def take_token(full_at: float, now: float, limit: Limit):
+    interval = limit.seconds / limit.requests
+    new_full_at = max(full_at, now) + interval
+    wait = new_full_at - limit.seconds - now
+    if wait > 1e-9:         # (not the rounding of the sum of the intervals)
+        return full_at, wait
+    return new_full_at, 0.0
+
+
+# "METHOD /path" of the route the request is going to (the middleware runs before the routing)
+def route_name(request):
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            if route.path == "/posts" and request.query_params.get("search_keyword"):
+                return f'{request.method} /posts?search_keyword'
+            return f'{request.method} {route.path}'
+    return f'{request.method} unmatched'
+
+
+class NullBackend:
+    async def take(self, key: str, limit: Limit):
+        return 0.0
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int):
+        # a bucket is forgotten once full (its ttl), and the least recently used ones go first when full
+        self._buckets = TTLCache(maxsize=maxsize, ttl=0)
+
+    # returns the seconds to wait, 0 when the request can go
+    async def take(self, key: str, limit: Limit):
+        now = time.monotonic()
+        full_at, wait = take_token(self._buckets.get(key) or now, now, limit)
+        if not wait:
+            self._buckets.set(key, full_at, ttl=full_at - now)
+        return wait
+
+
+# the time of the Redis server, so the clocks of the workers do not matter
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local requests, seconds = tonumber(ARGV[1]), tonumber(ARGV[2])
+local full_at = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now) + seconds / requests
+local wait = full_at - seconds - now
+if wait > 1e-9 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil((full_at - now) * 1000))
+return '0'
+"""
+
+
+class RedisBackend:
+    def __init__(self, client, prefix: str = "fastapi:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key: str, limit: Limit):
+        # (a float returned by a Lua script would be cut to an integer, hence the string)
+        return float(await self.client.eval(TOKEN_BUCKET_LUA, 1, self.prefix + key, limit.requests, limit.seconds))
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: dict):
+        self.backend = backend
+        self.limits = limits
+        self.limited = {}           # route -> requests refused
+        self.errors = 0             # checks which failed (and let the request through)
+
+    @property
+    def enabled(self):
+        return bool(self.limits) and not isinstance(self.backend, NullBackend)
+
+    def limit_of(self, route: str):
+        if route in self.limits:
+            return route, self.limits[route]
+        return "*", self.limits.get("*")
+
+    # returns the seconds the client has to wait before sending a request to the route, 0 when it can go
+    async def check(self, client: str, route: str):
+        name, limit = self.limit_of(route)
+        if limit is None:
+            return 0.0
+        try:
+            wait = await self.backend.take(f'{name}:{client}', limit)
+        except Exception:
+            self.errors += 1
+            return 0.0
+        if wait:
+            self.limited[name] = self.limited.get(name, 0) + 1
+        return wait
+
+    def stats(self):
+        return {"backend": type(self.backend).__name__, "enabled": self.enabled,
+                "limits": {route: f'{limit.requests}/{limit.seconds:g}' for route, limit in self.limits.items()},
+                "limited": self.limited, "errors": self.errors}
+
+
+class LoadShedder:
+    def __init__(self, max_requests: int):
+        self.max_requests = max_requests        # 0: never shed
+        self.in_progress = 0
+        self.shed = 0
+
+    # True when the request can be handled (then finished() has to be called), False to shed it
+    def start(self):
+        if self.max_requests and self.in_progress >= self.max_requests:
+            self.shed += 1
+            return False
+        self.in_progress += 1
+        return True
+
+    def finished(self):
+        self.in_progress -= 1
+
+    def stats(self):
+        return {"max_requests": self.max_requests, "in_progress": self.in_progress, "shed": self.shed}
+
+
+def create_backend():
+    if settings.rate_limit_backend == "redis":
+        # optional dependency, only needed for this backend
+        import redis.asyncio as redis
+        return RedisBackend(redis.from_url(settings.redis_url))
+    if settings.rate_limit_backend == "memory":
+        return MemoryBackend(settings.rate_limit_memory_keys)
+    return NullBackend()
+
+
+rate_limiter = RateLimiter(create_backend(), parse_limits(settings.rate_limits))
+# the requests the primary's connections can serve, plus the ones allowed to wait for a connection
+load_shedder = LoadShedder(settings.db_pool_size + settings.db_max_overflow + settings.load_shed_queue
+                           if settings.load_shed_queue >= 0 else 0)
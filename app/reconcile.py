@@ -0,0 +1,39 @@
+# Reconciliation job for the vote_count column of the posts (and the follower_count of the users)
+# cast_vote keeps vote_count up to date, but anything writing to the votes table directly
+# (a manual fix in PGAdmin, a restored backup, ...) makes it drift from the real number of votes
+# This job recounts the votes and repairs the posts that drifted
+# (follower_count drifts the same way, e.g. when a follower is deleted: the follows go by ON DELETE CASCADE)
+# Run it with: python -m app.reconcile
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import func
+from . import models
+
+
+# Sets vote_count to the real number of votes for every post where they differ
+# returns the number of repaired posts
+def reconcile_vote_counts(db: Session):
+    real_count = select(func.count(models.Vote.post_id)).where(
+        models.Vote.post_id == models.Post.id).scalar_subquery()
+    repaired = db.query(models.Post).filter(models.Post.vote_count != real_count).update(
+        {models.Post.vote_count: real_count}, synchronize_session=False)
+    db.commit()
+    return repaired
+
+
+# Same for the follower_count of the users (see feed.py)
+def reconcile_follower_counts(db: Session):
+    real_count = select(func.count(models.Follow.follower_id)).where(
+        models.Follow.followed_id == models.User.id).scalar_subquery()
+    repaired = db.query(models.User).filter(models.User.follower_count != real_count).update(
+        {models.User.follower_count: real_count}, synchronize_session=False)
+    db.commit()
+    return repaired
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    with SessionLocal() as db:
+        print(f'Repaired the vote count of {reconcile_vote_counts(db)} posts')
+        print(f'Repaired the follower count of {reconcile_follower_counts(db)} users')
@@ -0,0 +1,116 @@
+# Read replicas
+# The read-only endpoints (get_read_db in database.py) are served by the replicas of the .env file
+# (database_replicas), the writes always go to the primary (get_write_db)
+#
+# A read goes to the primary instead when:
+# - the client wrote something in the last replica_sticky_seconds (read-your-writes): a replica may not have
+#   the write yet, and the client would not see its own new post. The client is known by its bearer token,
+#   the clients without one are not tracked (behind a proxy they would all share one address)
+#   Note the writers are remembered per worker
+# - no replica is usable: every replica is down, or lags more than replica_max_lag_seconds behind the primary
+#
+# The lag and the health of a replica are checked at most every replica_check_seconds, by the request
+# which finds the last check too old (the other requests meanwhile use the last known state)
+# A replica which fails a check is left out until the next check
+import hashlib
+import time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+from .cache import TTLCache
+
+# 0 when the replica has replayed everything it received (an idle primary writes nothing,
+# so the age of the last replayed transaction alone would look like a growing lag), or when it is a primary
+LAG_SQL = text("SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+               "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END")
+
+
+class Replica:
+    def __init__(self, name: str, engine, sessionmaker):
+        self.name = name
+        self.engine = engine
+        self.sessionmaker = sessionmaker
+        self.lag = None             # seconds behind the primary, at the last check
+        self.error = None           # why the last check failed
+        self.checked_at = None
+        self.checking = False
+        self.reads = 0
+
+    # the engine the pool and the events are on
+    @property
+    def sync_engine(self):
+        return self.engine.sync_engine if isinstance(self.engine, AsyncEngine) else self.engine
+
+    def _check_sync(self):
+        with self.engine.connect() as conn:
+            return conn.execute(LAG_SQL).scalar()
+
+    async def check(self):
+        self.checking = True
+        try:
+            if isinstance(self.engine, AsyncEngine):
+                async with self.engine.connect() as conn:
+                    lag = (await conn.execute(LAG_SQL)).scalar()
+            else:
+                lag = await run_in_threadpool(self._check_sync)
+            self.lag, self.error = float(lag or 0), None
+        except Exception as error:
+            self.lag, self.error = None, f'{type(error).__name__}: {error}'
+        finally:
+            self.checked_at = time.monotonic()
+            self.checking = False
+
+    def usable(self, max_lag: float):
+        return self.error is None and self.lag is not None and self.lag <= max_lag
+
+    def stats(self):
+        return {"name": self.name, "lag_seconds": self.lag, "error": self.error, "reads": self.reads,
+                "checked_seconds_ago": time.monotonic() - self.checked_at if self.checked_at is not None else None}
+
+
+class ReplicaSet:
+    def __init__(self, replicas, max_lag: float, check_seconds: float, sticky_seconds: float):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self._writers = TTLCache(maxsize=100000, ttl=sticky_seconds)
+        self._next = 0
+        self.sticky_reads = 0       # reads sent to the primary after a write of the same client
+        self.fallback_reads = 0     # reads sent to the primary because no replica was usable
+
+    @staticmethod
+    def _client(request):
+        authorization = request.headers.get("authorization")
+        return hashlib.sha256(authorization.encode()).hexdigest() if authorization else None
+
+    # to call once a request wrote to the primary
+    def wrote(self, request):
+        client = self._client(request)
+        if client is not None:
+            self._writers.set(client, True)
+
+    # the replica to read from, or None for the primary
+    async def pick(self, request):
+        if not self.replicas:
+            return None
+        client = self._client(request)
+        if client is not None and self._writers.get(client):
+            self.sticky_reads += 1
+            return None
+        # round robin over the usable replicas
+        for i in range(len(self.replicas)):
+            index = (self._next + i) % len(self.replicas)
+            replica = self.replicas[index]
+            if not replica.checking and (replica.checked_at is None
+                                         or time.monotonic() - replica.checked_at > self.check_seconds):
+                await replica.check()
+            if replica.usable(self.max_lag):
+                self._next = index + 1
+                replica.reads += 1
+                return replica
+        self.fallback_reads += 1
+        return None
+
+    def stats(self):
+        return {"replicas": [replica.stats() for replica in self.replicas], "max_lag_seconds": self.max_lag,
+                "sticky_reads": self.sticky_reads, "fallback_reads": self.fallback_reads}
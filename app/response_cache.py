@@ -0,0 +1,146 @@
+# Read-through cache of the responses of GET /posts/{id} and GET /posts
+# The cached value is the JSON body of the response (and its headers), so a hit does not touch
+# the database or pydantic at all
+# An entry is stored as bytes: the headers as a JSON object on the first line, then the body
+#
+# Invalidation (see post.py and vote.py):
+# - a single post is cached under "post:<id>", deleted when the post is edited, deleted or voted
+# - the pages of GET /posts are cached under a key with the current "generation" of the posts;
+#   any write bumps the generation, so all the cached pages are dropped at once
+# Staleness bound: every entry also expires after response_cache_ttl_seconds, which bounds how long
+# a write made elsewhere (another worker with the memory backend, a manual change in the database)
+# can go unnoticed
+#
+# Backends (response_cache_backend in the settings):
+# - "memory": in-process LRU cache (per worker)
+# - "redis": shared by all the workers, any client with the redis.asyncio API works
+# - "none": no caching
+import json
+from typing import Optional
+import orjson
+from fastapi import Response
+from .cache import TTLCache
+from .config import settings
+from .serialization import render
+
+
+class NullBackend:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value: bytes, ttl: int):
+        pass
+
+    async def delete(self, key):
+        pass
+
+    async def get_counter(self, key):
+        return 0
+
+    async def incr(self, key):
+        return 0
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # the counters are kept apart, they must never be evicted or expire
+        self._counters = {}
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def set(self, key, value: bytes, ttl: int):
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key):
+        self._cache.invalidate(key)
+
+    async def get_counter(self, key):
+        return self._counters.get(key, 0)
+
+    async def incr(self, key):
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+
+class RedisBackend:
+    def __init__(self, client, prefix: str = "fastapi:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key):
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key, value: bytes, ttl: int):
+        await self.client.set(self.prefix + key, value, ex=ttl)
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+    async def get_counter(self, key):
+        return int(await self.client.get(self.prefix + key) or 0)
+
+    async def incr(self, key):
+        return await self.client.incr(self.prefix + key)
+
+
+class ResponseCache:
+    GENERATION_KEY = "posts:generation"
+
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    # returns the cached response, or None
+    async def get(self, key: str) -> Optional[Response]:
+        entry = await self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        headers, body = entry.split(b"\n", 1)
+        return Response(content=body, media_type="application/json", headers=orjson.loads(headers))
+
+    # caches the response data (already dumped to dicts, see serialization.py) and returns it as a response
+    async def set(self, key: str, data, headers: dict = None) -> Response:
+        body = render(data)
+        await self.backend.set(key, orjson.dumps(headers or {}) + b"\n" + body, self.ttl)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def post_key(self, post_id: int):
+        return f'post:{post_id}'
+
+    # the key of a page of posts depends on all the query parameters and the current generation
+    async def posts_key(self, *params):
+        generation = await self.backend.get_counter(self.GENERATION_KEY)
+        return f'posts:{generation}:{json.dumps(params)}'
+
+    # to call once a post has been created/edited/deleted/voted (after the commit)
+    async def post_changed(self, post_id: int):
+        await self.backend.delete(self.post_key(post_id))
+        await self.posts_changed()
+
+    # to call once posts have been added (none of them can be cached yet), only the pages are dropped
+    async def posts_changed(self):
+        await self.backend.incr(self.GENERATION_KEY)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"backend": type(self.backend).__name__, "ttl_seconds": self.ttl, "hits": self.hits,
+                "misses": self.misses, "hit_ratio": self.hits / requests if requests else 0.0}
+
+
+def create_backend():
+    if settings.response_cache_backend == "redis":
+        # optional dependency, only needed for this backend
+        import redis.asyncio as redis
+        return RedisBackend(redis.from_url(settings.redis_url))
+    if settings.response_cache_backend == "memory":
+        return MemoryBackend(settings.response_cache_size, settings.response_cache_ttl_seconds)
+    return NullBackend()
+
+
+response_cache = ResponseCache(create_backend(), settings.response_cache_ttl_seconds)
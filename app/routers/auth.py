@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Header
 from fastapi.security import OAuth2PasswordBearer
 from typing import Optional, List
 from pydantic import BaseModel
@@ -7,11 +7,15 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+import hashlib
+import hmac
+import time
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 # we get the schemas from the schemas.py file
 # . represents our current directory
-from .. import models, schemas, utils
-from ..database import engine, get_db
+from .. import models, schemas, utils, cache
+from ..database import engine, get_db, run_db
 from ..config import settings
 
 
@@ -23,13 +27,25 @@ router = APIRouter(
 
 @router.post("/login", response_model=schemas.Token)
 async def login(user_creds: schemas.UserLoginStructure, db: Session = Depends(get_db)):
-    user_db = db.query(models.User).filter(
-        models.User.email == user_creds.email).first()
+    def query_user(db: Session):
+        return db.query(models.User).filter(
+            models.User.email == user_creds.email).first()
+
+    # the stored hash is upgraded if it was made with another bcrypt cost than the current one
+    def update_password(db: Session):
+        db.query(models.User).filter(models.User.id == user_db.id).update(
+            {models.User.password: new_hash}, synchronize_session=False)
+        db.commit()
+
+    user_db = await run_db(db, query_user)
     if user_db:
         # Get the password and convert it to a hashed password and compare it with the db stored password for the user
-        verification_status = utils.verify_password(
+        # (in the password pool, bcrypt is too slow to run it in the event loop)
+        verification_status, new_hash = await utils.verify_and_update_password(
             user_creds.password, user_db.password)
         if verification_status:
+            if new_hash:
+                await run_db(db, update_password)
             # the payload in the data is choosen by me (I chose to just encode the user email)
             access_token = create_access_token(data={"user_id": user_db.id})
             # we just add the "bearer" in the "token type" while returning, no reason whatsoever
@@ -69,8 +85,46 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+# The same token is sent again and again until it expires, so once a token is verified
+# we keep its TokenData in a cache (by the sha256 digest of the token, not the token itself)
+# and the next requests with this token skip the signature check and the parsing of the claims
+# An entry expires at the same time as its token, so an expired token is never accepted from the cache
+token_cache = cache.TTLCache(maxsize=settings.token_cache_size,
+                             ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# Revoked tokens (by digest), with the time they expire at
+# Once a token has expired it is rejected anyway, so it is dropped from this list
+revoked_tokens = {}
+
+
+def token_digest(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def is_revoked(digest: str):
+    return digest in revoked_tokens
+
+
+# A revoked token is rejected from now on, even though it has not expired yet
+def revoke_token(token: str, expires_at: float):
+    now = time.time()
+    for digest, expiry in list(revoked_tokens.items()):
+        if expiry <= now:
+            revoked_tokens.pop(digest, None)
+    digest = token_digest(token)
+    revoked_tokens[digest] = expires_at
+    token_cache.invalidate(digest)
+
+
 # Next we need to verify the access token
 def verify_access_token(token: str, cred_exception):
+    digest = token_digest(token)
+    if is_revoked(digest):
+        raise cred_exception
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return token_data
+
     try:
         payload_data = jwt.decode(
             token, key=SECRET_KEY, algorithms=[ALGORITHM])
@@ -83,12 +137,36 @@ def verify_access_token(token: str, cred_exception):
     except JWTError:
         raise cred_exception
 
+    # our tokens always have an expiration time, a token without one is cached with the default ttl
+    expires_at = payload_data.get("exp")
+    token_cache.set(digest, token_data,
+                    ttl=expires_at - time.time() if expires_at else None)
     return token_data
 
 
 # get the path "/login and remove the slash (/) and put it here"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='login')
 
+# Cache of the logged in users (by user id), so that an authenticated request does not need
+# a database query just to know who is calling
+# The cached users are plain schemas.UserResponseStructure (no password, not attached to any session)
+user_cache = cache.TTLCache(maxsize=settings.user_cache_size,
+                            ttl=settings.user_cache_ttl_seconds)
+
+
+# Invalidation hook: needs to be called whenever a user is changed or deleted
+def invalidate_user(user_id: int):
+    user_cache.invalidate(user_id)
+
+
+# Users changed or deleted through the ORM are invalidated automatically
+# (bulk query.update()/delete() do not go through these events, call invalidate_user() there)
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, user):
+    invalidate_user(user.id)
+
+
 # We can pass this as a dependency
 # This is going to take the token from the request automatically
 # extract the ID for us
@@ -96,11 +174,44 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl='login')
 # automatically fetch the user and add as a parameter to the path operation function
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     creds_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                     detail=f'Invalid credentials', headers={"WWW-Authenticate": "Bearer"})
 
     # return verify_access_token(token, creds_exception)
     token = verify_access_token(token, creds_exception)
-    user = db.query(models.User).filter(models.User.id == token.id).first()
+
+    user = user_cache.get(token.id)
+    if user is not None:
+        return user
+
+    def query_user(db: Session):
+        return db.query(models.User).filter(models.User.id == token.id).first()
+
+    user_db = await run_db(db, query_user)
+    if not user_db:     # the user of the token does not exist (anymore)
+        raise creds_exception
+    user = schemas.UserResponseStructure.from_orm(user_db)
+    user_cache.set(user.id, user)
     return user
+
+
+# Logout: the token of the request can not be used anymore
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(oauth2_scheme)):
+    creds_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                    detail=f'Invalid credentials', headers={"WWW-Authenticate": "Bearer"})
+    verify_access_token(token, creds_exception)
+    revoke_token(token, jwt.get_unverified_claims(token)["exp"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+def is_admin(admin_token: Optional[str]):
+    return bool(settings.admin_token) and hmac.compare_digest(admin_token or "", settings.admin_token)
+
+
+# Dependency for the internal/admin endpoints: the X-Admin-Token header needs to be the admin token of the settings
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f'Not authorized')
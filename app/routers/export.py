@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+from datetime import datetime
+from enum import Enum
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .. import models
+from ..config import settings
+from ..database import get_read_db, stream_db
+from . import auth
+
+
+# Export of whole tables, only for the admins (see auth.require_admin)
+# The rows are read with a server-side cursor and written to the response batch by batch,
+# so the memory used stays the same however big the table is, and the first bytes go out straight away
+router = APIRouter(
+    prefix="/export",
+    tags=['Export'],   # for grouping our documentation in FastAPI into categories
+    dependencies=[Depends(auth.require_admin)]
+)
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"   # one JSON object per line
+    csv = "csv"
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+async def export_rows(db: Session, statement, format: ExportFormat):
+    columns = [column.name for column in statement.selected_columns]
+    if format == ExportFormat.csv:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for rows in stream_db(db, statement, settings.export_batch_size):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # only the header when the table is empty
+        yield buffer.getvalue()
+    else:
+        async for rows in stream_db(db, statement, settings.export_batch_size):
+            yield "".join(json.dumps(dict(zip(columns, row)), default=json_default) + "\n" for row in rows)
+
+
+def export_response(db: Session, statement, format: ExportFormat, name: str):
+    media_type = "text/csv" if format == ExportFormat.csv else "application/x-ndjson"
+    return StreamingResponse(export_rows(db, statement, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{format.value}"'})
+
+
+# Every user, without the password
+@router.get("/users")
+async def export_users(format: ExportFormat = ExportFormat.ndjson, db: Session = Depends(get_read_db)):
+    statement = select(models.User.id, models.User.email, models.User.name,
+                       models.User.created_at).order_by(models.User.id)
+    return export_response(db, statement, format, "users")
+
+
+@router.get("/posts")
+async def export_posts(format: ExportFormat = ExportFormat.ndjson, db: Session = Depends(get_read_db)):
+    statement = select(models.Post.id, models.Post.title, models.Post.content, models.Post.published,
+                       models.Post.rating, models.Post.created_at, models.Post.owner_id,
+                       models.Post.vote_count).order_by(models.Post.id)
+    return export_response(db, statement, format, "posts")
@@ -0,0 +1,55 @@
+from fastapi import Response, status, HTTPException, Depends, APIRouter
+from fastapi.responses import ORJSONResponse
+from typing import Optional, List
+from sqlalchemy.orm import Session
+# we get the schemas from the schemas.py file
+# . represents our current directory
+from .. import schemas, utils, feed
+from ..database import get_read_db, get_write_db, run_db
+from ..serialization import dump_list
+from . import auth
+
+# Create a router object
+router = APIRouter(
+    tags=['Feed']   # for grouping our documentation in FastAPI into categories
+)
+
+
+# Follow a user (their next posts go into the feed of the current user, see feed.py)
+@router.post("/users/{id}/follow", status_code=status.HTTP_201_CREATED)
+async def follow_user(id: int, db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user)):
+    status_code, detail = await run_db(db, feed.follow, current_user.id, id)
+    if status_code != status.HTTP_201_CREATED:
+        # 400: following yourself; 404: no such user; 409: already followed
+        raise HTTPException(status_code=status_code, detail=detail)
+    return {"follow message": detail}
+
+
+# Unfollow a user (their posts leave the feed of the current user)
+@router.delete("/users/{id}/follow", status_code=status.HTTP_204_NO_CONTENT)
+async def unfollow_user(id: int, db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user)):
+    status_code, detail = await run_db(db, feed.unfollow, current_user.id, id)
+    if status_code != status.HTTP_204_NO_CONTENT:
+        raise HTTPException(status_code=status_code, detail=detail)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+# The feed of the current user: the posts of the accounts they follow (and their own), newest first
+# 'cursor' is the X-Next-Cursor header of the previous page, like for GET /posts
+@router.get("/feed", response_model=List[schemas.PostVoteStructure])
+async def get_feed(db: Session = Depends(get_read_db), current_user: int = Depends(auth.get_current_user), limit: int = 10, cursor: Optional[str] = None):
+    before = None
+    if cursor:
+        try:
+            before = utils.decode_cursor(cursor)[1]
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f'Invalid cursor {cursor}')
+
+    rows = await run_db(db, feed.read_feed, current_user.id, limit, before)
+    headers = {}
+    if limit > 0 and len(rows) == limit:
+        last_post = rows[-1].Post
+        headers["X-Next-Cursor"] = utils.encode_cursor(last_post.created_at, last_post.id)
+    # the rows are dumped without validating them again (see serialization.py)
+    return ORJSONResponse(dump_list(schemas.PostVoteStructure, rows), headers=headers)
@@ -0,0 +1,84 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from starlette.concurrency import run_in_threadpool
+from .. import profiling
+from ..config import settings
+from ..database import engine, async_engine, replica_set
+from ..pool import pool_status
+from ..ratelimit import rate_limiter, load_shedder
+from ..response_cache import response_cache
+from ..slow_queries import slow_queries
+from ..votes import vote_buffer
+from . import auth
+
+
+# Endpoints for the people running the API (not the users), all of them need the admin token
+router = APIRouter(
+    prefix="/internal",
+    tags=['Internal'],   # for grouping our documentation in FastAPI into categories
+    dependencies=[Depends(auth.require_admin)]
+)
+
+
+# Size and hit ratio of the caches
+@router.get("/cache")
+async def cache_stats():
+    return {"users": auth.user_cache.stats(),
+            "tokens": auth.token_cache.stats(),
+            "responses": response_cache.stats()}
+
+
+# Batches written by the vote buffer (see votes.py)
+@router.get("/vote-buffer")
+async def vote_buffer_stats():
+    return vote_buffer.stats()
+
+
+# Budgets and refused requests of the rate limiter, and the requests shed under load (see ratelimit.py)
+@router.get("/limits")
+async def limit_stats():
+    return {"rate_limit": rate_limiter.stats(), "load_shedding": load_shedder.stats()}
+
+
+# Lag and reads of the read replicas, and the reads sent to the primary instead (see replicas.py)
+@router.get("/replicas")
+async def replica_stats():
+    return replica_set.stats()
+
+
+# Live statistics of the connection pools (checked out, overflow, wait time histogram)
+@router.get("/pool")
+async def pool_stats():
+    pools = {"sync": pool_status(engine)}
+    if async_engine is not None:
+        pools["async"] = pool_status(async_engine.sync_engine)
+    for replica in replica_set.replicas:
+        pools[f'replica {replica.name}'] = pool_status(replica.sync_engine)
+    return pools
+
+
+# Latest slow queries, newest first (with their plan when it was captured)
+@router.get("/slow-queries")
+async def get_slow_queries():
+    return list(reversed(slow_queries))
+
+
+# Saved request profiles, newest first
+@router.get("/profiles")
+async def get_profiles():
+    return profiling.list_profiles()
+
+
+# Download a profile (pstats file)
+@router.get("/profiles/{name}")
+async def get_profile(name: str):
+    if name not in profiling.list_profiles():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f'Profile {name} not found')
+
+    def read_profile():
+        with open(os.path.join(settings.profile_dir, name), "rb") as profile_file:
+            return profile_file.read()
+
+    return Response(content=await run_in_threadpool(read_profile), media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Response
+from .. import metrics
+from ..database import engine, async_engine, replica_set
+from ..pool import pool_status
+from ..ratelimit import rate_limiter, load_shedder
+from ..response_cache import response_cache
+from ..votes import vote_buffer
+from . import auth
+
+
+router = APIRouter(
+    tags=['Metrics']   # for grouping our documentation in FastAPI into categories
+)
+
+
+# Pools and caches, next to the metrics of the requests
+def extra_metrics():
+    pools = [("sync", pool_status(engine))]
+    if async_engine is not None:
+        pools.append(("async", pool_status(async_engine.sync_engine)))
+    pools += [(f'replica {replica.name}', pool_status(replica.sync_engine)) for replica in replica_set.replicas]
+    caches = [("users", auth.user_cache.stats()), ("tokens", auth.token_cache.stats()),
+              ("responses", response_cache.stats())]
+    return {
+        "db_pool_checked_out": ("gauge", "Connections in use",
+                                [({"engine": name}, pool["checked_out"]) for name, pool in pools]),
+        "db_pool_overflow": ("gauge", "Connections opened on top of the pool size",
+                             [({"engine": name}, pool["overflow"]) for name, pool in pools]),
+        "db_pool_timeouts_total": ("counter", "Checkouts which timed out",
+                                   [({"engine": name}, pool["timeouts"]) for name, pool in pools]),
+        "cache_hits_total": ("counter", "Cache hits",
+                             [({"cache": name}, stats["hits"]) for name, stats in caches]),
+        "cache_misses_total": ("counter", "Cache misses",
+                               [({"cache": name}, stats["misses"]) for name, stats in caches]),
+        "vote_buffer_flushes_total": ("counter", "Batches of votes written by the vote buffer",
+                                      [({}, vote_buffer.flushes)]),
+        "vote_buffer_votes_total": ("counter", "Votes written by the vote buffer",
+                                    [({}, vote_buffer.votes)]),
+        "rate_limited_requests_total": ("counter", "Requests refused by the rate limiter (429)",
+                                        [({"route": route}, count) for route, count in rate_limiter.limited.items()]),
+        "shed_requests_total": ("counter", "Requests refused by the load shedding (503)",
+                                [({}, load_shedder.shed)]),
+        "db_reads_total": ("counter", "Reads of the read-only endpoints, by the database serving them",
+                           [({"database": f'replica {replica.name}'}, replica.reads)
+                            for replica in replica_set.replicas]
+                           + [({"database": "primary", "reason": "sticky"}, replica_set.sticky_reads),
+                              ({"database": "primary", "reason": "fallback"}, replica_set.fallback_reads)]),
+        "db_replica_lag_seconds": ("gauge", "Lag of the replicas behind the primary, at their last check",
+                                   [({"replica": replica.name}, replica.lag) for replica in replica_set.replicas
+                                    if replica.lag is not None]),
+    }
+
+
+# Prometheus text format
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.render(metrics.request_metrics, extra_metrics()),
+                    media_type="text/plain; version=0.0.4")
@@ -1,14 +1,18 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Header
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List
 from pydantic import BaseModel
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from sqlalchemy.orm import Session
-from sqlalchemy.sql.functions import func
+from sqlalchemy import tuple_, insert, update, delete, select
+from sqlalchemy.orm import Load, Session, joinedload
 # we get the schemas from the schemas.py file
 # . represents our current directory
-from .. import models, schemas, utils
-from ..database import engine, get_db
+from .. import models, schemas, utils, search, feed
+from ..serialization import dump, dump_list
+from ..database import engine, get_read_db, get_write_db, run_db
+from ..config import settings
+from ..response_cache import response_cache
 from . import auth
 
 
@@ -18,6 +22,29 @@ router = APIRouter(
 )
 
 
+# 'fields' query parameter (sparse fieldset), e.g. fields=id,title: only these fields of the posts are
+# returned (see schemas.post_fields), and only their columns are read from the database,
+# the other ones are deferred (the owners are not even joined unless "owner" is asked for)
+# Without it the posts are returned whole
+def parse_fields(fields: Optional[str]):
+    try:
+        return schemas.post_fields(fields)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+
+# the loader options of a query of posts with the given fields
+# (id, created_at and version are always read: the cursor of the next page and the ETag need them)
+def post_loading(fields):
+    if fields is None:
+        return [joinedload(models.Post.owner)]
+    columns = {name for name in fields if name != "owner"} | {"id", "created_at", "version"}
+    options = [Load(models.Post).load_only(*sorted(columns))]
+    if "owner" in fields:
+        options.append(joinedload(models.Post.owner))
+    return options
+
+
 # Root path
 @router.get("/")
 async def root():
@@ -29,27 +56,71 @@ async def root():
 @router.get("/posts", response_model=List[schemas.PostVoteStructure])
 # 'limit' argument is the query parameter that will be used to limit the number of posts to be displayed
 # default value added to limit is 5
-# 'skip' argument is another query parameter to skip the given number of results (useful for pagination)
-# default value added to skip is 2
+# 'cursor' argument is the opaque cursor returned in the X-Next-Cursor header of the previous page
+# Without a cursor, the first page (newest posts) is returned
+# The posts are paged by (created_at, id), so a page costs the same no matter how deep it is
+# 'skip' argument is the legacy (OFFSET) pagination: if it is given, the given number of results are skipped
+# Postgres still reads all the skipped rows, so deep pages get slower and slower
 # 'search_keyword' argument is added to search through the title
 # It is optional. Using .contains(search_keyword) will search if the string is contained (substring) in the title
+# No index can serve this substring search, use GET /posts/search for the indexed full-text search
 # For searching in Postman, if there is a space between two words we are searching, use %20 between the words
 # In Postman, use the ? to add query parameters
 # In Postman, to add more query parameters use &
-async def get_posts(db: Session = Depends(get_db), limit: int = 5, skip: int = 2, search_keyword: Optional[str] = ""):
+# 'fields' argument narrows the posts to some of their fields (see parse_fields)
+async def get_posts(db: Session = Depends(get_read_db), limit: int = 5, skip: Optional[int] = None, cursor: Optional[str] = None, search_keyword: Optional[str] = "", fields: Optional[str] = None):
     # add all_posts query to the below query with inner join and couting votes
     # all_posts = db.query(models.Post).filter(models.Post.title.contains(
     #     search_keyword)).limit(limit).offset(skip).all()
 
-    # SQLAlchemy by default makes an INNER LEFT JOIN, but we need an OUTER LEFT JOIN, so we pass flag isouter=True
+    # The votes used to be counted with an OUTER LEFT JOIN on the votes and a groupby post.id for every request
+    # Now every post keeps its number of votes in the vote_count column (updated by cast_vote in vote.py)
     # Using .label() we can rename a column in the sql output (similar to AS in raw SQL)
-    # We groupby post.id and count with post.id (the column needs to be passed to count instead of using * to disallow counting null)
-    # This will give me the number of votes for each post id (excluding the posts with null votes)
-    count_votes_query = db.query(models.Post, func.count(models.Vote.post_id).label("votes")).join(
-        models.Vote, models.Vote.post_id == models.Post.id, isouter=True).group_by(models.Post.id).filter(models.Post.title.contains(search_keyword)).limit(limit).offset(skip).all()
+    # joinedload fetches the owners of the posts in the same query (JOIN users), since the response needs them
+    # Otherwise serializing a page of N posts would lazy load every owner: N more queries
+    # (and with the async session they can not even be lazy loaded later)
+    def query_posts(db: Session):
+        posts_query = db.query(models.Post, models.Post.vote_count.label("votes")).options(
+            *post_loading(post_fields))
+        # an empty keyword matches every post, so there is no need to filter (and scan the titles)
+        if search_keyword:
+            posts_query = posts_query.filter(
+                models.Post.title.contains(search_keyword))
+        if skip is not None:
+            return posts_query.limit(limit).offset(skip).all()
+        # keyset pagination: newest posts first, continuing after the last post of the previous page
+        if after is not None:
+            posts_query = posts_query.filter(
+                tuple_(models.Post.created_at, models.Post.id) < after)
+        return posts_query.order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(limit).all()
+
+    post_fields = parse_fields(fields)
+    after = None
+    if skip is None and cursor:
+        try:
+            after = utils.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f'Invalid cursor {cursor}')
+
+    # read-through cache (see response_cache.py): a cached page is returned as it is
+    cache_key = await response_cache.posts_key(limit, skip, cursor, search_keyword, post_fields)
+    cached_response = await response_cache.get(cache_key)
+    if cached_response:
+        return cached_response
+
+    count_votes_query = await run_db(db, query_posts)
+    headers = {}
+    # a full page means there may be more posts, so we hand out the cursor for the next one
+    if skip is None and limit > 0 and len(count_votes_query) == limit:
+        last_post = count_votes_query[-1].Post
+        headers["X-Next-Cursor"] = utils.encode_cursor(
+            last_post.created_at, last_post.id)
     # return {"get all posts": all_posts}
     # return all_posts
-    return count_votes_query
+    # the rows are dumped without validating them again (see serialization.py)
+    return await response_cache.set(
+        cache_key, dump_list(schemas.post_vote_structure(post_fields), count_votes_query), headers)
 
 
 # # Get latest post
@@ -61,20 +132,56 @@ async def get_posts(db: Session = Depends(get_db), limit: int = 5, skip: int = 2
 #     return lastest_post
 
 
+# Full-text search through the title and content of the posts, best match first
+# Note this needs to be declared before /posts/{id}, otherwise "search" is taken as an id
+@router.get("/posts/search", response_model=List[schemas.PostSearchStructure])
+async def search_posts(q: str, db: Session = Depends(get_read_db), limit: int = 10):
+    def query_posts(db: Session):
+        return search.search_posts(db, q, limit)
+
+    return ORJSONResponse(dump_list(schemas.PostSearchStructure, await run_db(db, query_posts)))
+
+
 # Get post for an ID
 # @router.get("/posts/{id}", response_model=schemas.ResponseStructureBase)
+# Conditional GET: the response has the ETag of the post (see utils.post_etag),
+# a client sending it back in If-None-Match gets an empty 304 Not Modified while the post did not change
+# 'fields' narrows the post like for GET /posts
 @router.get("/posts/{id}", response_model=schemas.PostVoteStructure)
-async def get_post(id: int, db: Session = Depends(get_db)):
+async def get_post(id: int, db: Session = Depends(get_read_db), if_none_match: Optional[str] = Header(None), fields: Optional[str] = None):
     # filter is similar to WHERE in SQL
     # .first() will find the first instance and return the results
     # add id_post query to the below query with inner join and couting votes
     # id_post = db.query(models.Post).filter(
     #     models.Post.id == id).first()
-    id_post = db.query(models.Post, func.count(models.Vote.post_id).label("votes")).join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True).group_by(models.Post.id).filter(
-        models.Post.id == id).first()
+    def query_post(db: Session):
+        return db.query(models.Post, models.Post.vote_count.label("votes")).filter(
+            models.Post.id == id).options(*post_loading(post_fields)).first()
+
+    def not_modified(response: Response):
+        etag = response.headers.get("etag")
+        if if_none_match and etag and utils.etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return response
+
+    post_fields = parse_fields(fields)
+    # read-through cache (see response_cache.py), the ETag is cached with the response
+    # only the whole post is cached (a narrowed post is a primary key lookup of a few columns)
+    if post_fields is None:
+        cached_response = await response_cache.get(response_cache.post_key(id))
+        if cached_response:
+            return not_modified(cached_response)
+
+    id_post = await run_db(db, query_post)
+    if id_post and post_fields is not None:
+        return not_modified(ORJSONResponse(
+            dump(schemas.post_vote_structure(post_fields), id_post),
+            headers={"ETag": utils.post_etag(id_post.Post.version, id_post.votes, post_fields)}))
     if id_post:
         # return {"get post with id": id_post}
-        return id_post
+        return not_modified(await response_cache.set(
+            response_cache.post_key(id), dump(schemas.PostVoteStructure, id_post),
+            {"ETag": utils.post_etag(id_post.Post.version, id_post.votes)}))
     else:
         # return {"get post with ID" : f'Post with id {id} not found'}
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -83,7 +190,7 @@ async def get_post(id: int, db: Session = Depends(get_db)):
 
 # Create a post
 @router.post("/posts", status_code=status.HTTP_201_CREATED, response_model=schemas.ResponseStructureBase)
-async def create_posts(post: schemas.PostCreate, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
+async def create_posts(post: schemas.PostCreate, db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user)):
     # We would now need user login authorization
     # In Postman, to send an authorization token, do the following:
     # 1. Go to http://127.0.0.1:8000/login (Post) and copy the access_token
@@ -98,55 +205,115 @@ async def create_posts(post: schemas.PostCreate, db: Session = Depends(get_db),
     # so we use the below method, where we convert the post to a dictionary
     # and then using **, we unpack the dictionary
     new_post = models.Post(owner_id=current_user.id, **post.dict())
-    # We should be able to use this login information of the user to add it as the foreign key to the posts table
-    # second, we add it to our database
-    db.add(new_post)
-    # next, we commit our changes to the database (so that we can see in PGAdmin now)
-    db.commit()
-    # and we retrieve the new post we created and store it back to the the variable new_post
-    db.refresh(new_post)
+
+    def insert_post(db: Session):
+        # We should be able to use this login information of the user to add it as the foreign key to the posts table
+        # second, we add it to our database
+        db.add(new_post)
+        # the post goes into the feeds of the followers in the same transaction (see feed.py)
+        db.flush()
+        feed.fan_out(db, current_user.id, [new_post.id])
+        # next, we commit our changes to the database (so that we can see in PGAdmin now)
+        db.commit()
+        # and we retrieve the new post we created and store it back to the the variable new_post
+        # (together with its owner, which is part of the response)
+        db.refresh(new_post)
+        new_post.owner
+
+    await run_db(db, insert_post)
+    search.post_changed(new_post.id, new_post.title, new_post.content)
+    await response_cache.post_changed(new_post.id)
     # return {"new post created": new_post}
     return new_post
 
 
+# Create many posts at once (for the importers)
+# All the posts are written with one multi-row INSERT ... RETURNING, in one transaction
+# (instead of one request, one auth lookup and one commit per post)
+@router.post("/posts/bulk", status_code=status.HTTP_201_CREATED, response_model=List[schemas.BulkPostResult])
+async def create_posts_bulk(posts: List[schemas.PostCreate], db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user)):
+    if len(posts) > settings.bulk_max_items:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {settings.bulk_max_items} posts per request')
+    if not posts:
+        return []
+
+    # Postgres returns the rows of a multi-row INSERT ... RETURNING in the order of the VALUES
+    def insert_posts(db: Session):
+        new_posts = db.execute(insert(models.Post).values([dict(owner_id=current_user.id, **post.dict()) for post in posts]).returning(
+            *models.Post.__table__.columns)).all()
+        feed.fan_out(db, current_user.id, [new_post.id for new_post in new_posts])
+        db.commit()
+        return new_posts
+
+    new_posts = await run_db(db, insert_posts)
+    for new_post in new_posts:
+        search.post_changed(new_post.id, new_post.title, new_post.content)
+    await response_cache.posts_changed()
+    return [{"index": index, "status_code": status.HTTP_201_CREATED, "post": dict(new_post._mapping, owner=current_user)}
+            for index, new_post in enumerate(new_posts)]
+
+
+# Edits and deletions are one statement, scoped to the owner of the post:
+# UPDATE/DELETE ... WHERE id = :id AND owner_id = :current_user [AND version IN (:if_match)] RETURNING ...
+# Only when no row was changed, one more query tells why: no such post (404), the post of another user (403),
+# or the post was edited meanwhile (412, the version is not the one of the If-Match header)
+# If-Match is optional: without it the post is changed whatever its version
+def _conditions(id: int, owner_id: int, if_match: Optional[str]):
+    conditions = [models.Post.id == id, models.Post.owner_id == owner_id]
+    if if_match:
+        versions = utils.if_match_versions(if_match)
+        if versions is not None:
+            conditions.append(models.Post.version.in_(versions))
+    return conditions
+
+
+def _why_unchanged(db: Session, id: int, owner_id: int, action: str):
+    post = db.execute(select(models.Post.owner_id).where(models.Post.id == id)).first()
+    if post is None:
+        return status.HTTP_404_NOT_FOUND, f'Post with id {id} not found'
+    if post.owner_id != owner_id:
+        # an user should be able to update/delete his own post only, not some other user's post
+        return status.HTTP_403_FORBIDDEN, f'Not authorized to {action} different user post'
+    return status.HTTP_412_PRECONDITION_FAILED, f'Post with id {id} was modified, get it again before you {action} it'
+
+
 # Delete a post
+# (the post leaves the feeds with it, see feed.py)
 @router.delete("/posts/{id}")
-async def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
-    deleted_post = db.query(models.Post).filter(models.Post.id == id)
-
-    if deleted_post.first():
-        # an user should be able to delete his own post only, not some other user's post
-        if deleted_post.first().owner_id != current_user.id:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail=f'Not authorized to delete different user post')
-        # no justification for synchronize_session=False, SQLAlchemy doc says so, thats why
-        deleted_post.delete(synchronize_session=False)
+async def delete_post(id: int, db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user), if_match: Optional[str] = Header(None)):
+    def remove_post(db: Session):
+        deleted = db.execute(delete(models.Post.__table__).where(
+            *_conditions(id, current_user.id, if_match)).returning(models.Post.id)).first()
         db.commit()
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
-    else:
-        # return {"get post with ID" : f'Post with id {id} not found'}
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f'Post with id {id} not found')
+        return None if deleted else _why_unchanged(db, id, current_user.id, "delete")
+
+    error = await run_db(db, remove_post)
+    if error:
+        raise HTTPException(status_code=error[0], detail=error[1])
+    search.post_deleted(id)
+    await response_cache.post_changed(id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 # Update a post (Edit)
+# The response has the new ETag of the post, for the next edit
 @router.put("/posts/{id}", response_model=schemas.ResponseStructureBase)
-async def update_post(id: int, edited_post: schemas.PostUpdate, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
-    updated_post = db.query(models.Post).filter(models.Post.id == id)
-
-    if updated_post.first():
-        # an user should be able to update/edit his own post only, not some other user's post
-        if updated_post.first().owner_id != current_user.id:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail=f'Not authorized to modify different user post')
-        updated_post.update(edited_post.dict(), synchronize_session=False)
+async def update_post(id: int, edited_post: schemas.PostUpdate, response: Response, db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user), if_match: Optional[str] = Header(None)):
+    def edit_post(db: Session):
+        updated = db.execute(update(models.Post.__table__).where(*_conditions(id, current_user.id, if_match)).values(
+            version=models.Post.version + 1, **edited_post.dict()).returning(*models.Post.__table__.columns)).first()
         db.commit()
-        # return {"edited post": updated_post.first()}
-        return updated_post.first()
-    else:
-        # return {"get post with ID" : f'Post with id {id} not found'}
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f'Post with id {id} not found')
+        return updated, None if updated else _why_unchanged(db, id, current_user.id, "modify")
+
+    updated_post, error = await run_db(db, edit_post)
+    if error:
+        raise HTTPException(status_code=error[0], detail=error[1])
+    search.post_changed(updated_post.id, updated_post.title, updated_post.content)
+    await response_cache.post_changed(id)
+    response.headers["ETag"] = utils.post_etag(updated_post.version, updated_post.vote_count)
+    # the owner of the post is the current user, no need to load it
+    return dict(updated_post._mapping, owner=current_user)
 
 
 # # Testing sqlalchemy
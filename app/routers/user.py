@@ -1,4 +1,5 @@
 from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List
 from pydantic import BaseModel
 from passlib.context import CryptContext
@@ -7,7 +8,8 @@ from psycopg2.extras import RealDictCursor
 from sqlalchemy.orm import Session
 # we get the schemas from the schemas.py file
 from .. import models, schemas, utils        # . represents our current directory
-from ..database import engine, get_db
+from ..database import engine, get_read_db, get_write_db, run_db
+from ..serialization import dump, dump_list
 
 
 # Create a router object
@@ -18,32 +20,44 @@ router = APIRouter(
 
 # Create a new user
 @router.post("/users", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponseStructure)
-async def create_users(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_users(user: schemas.UserCreate, db: Session = Depends(get_write_db)):
     # hash the password before saving to the database
-    hashed_pass = utils.hash_function(user.password)
+    # (in the password pool, bcrypt is too slow to run it in the event loop)
+    hashed_pass = await utils.hash_password_async(user.password)
     user.password = hashed_pass
 
     new_user = models.User(**user.dict())
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+
+    def insert_user(db: Session):
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+
+    await run_db(db, insert_user)
 
     return new_user
 
 
 # Get all users
 @router.get("/users", response_model=List[schemas.UserResponseStructure])
-async def get_users(db: Session = Depends(get_db)):
-    all_users = db.query(models.User).all()
-    return all_users
+async def get_users(db: Session = Depends(get_read_db)):
+    def query_users(db: Session):
+        return db.query(models.User).all()
+
+    all_users = await run_db(db, query_users)
+    # the rows are dumped without validating them again (see serialization.py)
+    return ORJSONResponse(dump_list(schemas.UserResponseStructure, all_users))
 
 
 # Get user data for an id
 @router.get("/users/{id}", response_model=schemas.UserResponseStructure)
-async def get_user(id: int, db: Session = Depends(get_db)):
-    id_user = db.query(models.User).filter(models.User.id == id).first()
+async def get_user(id: int, db: Session = Depends(get_read_db)):
+    def query_user(db: Session):
+        return db.query(models.User).filter(models.User.id == id).first()
+
+    id_user = await run_db(db, query_user)
     if id_user:
-        return id_user
+        return ORJSONResponse(dump(schemas.UserResponseStructure, id_user))
     else:
         # return {"get user with ID" : f'User with id {id} not found'}
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -6,8 +6,11 @@ from psycopg2.extras import RealDictCursor
 from sqlalchemy.orm import Session
 # we get the schemas from the schemas.py file
 # . represents our current directory
-from .. import models, schemas, utils
-from ..database import engine, get_db
+from .. import models, schemas, utils, votes
+from ..database import engine, get_read_db, get_write_db, run_db, release_db
+from ..config import settings
+from ..response_cache import response_cache
+from ..votes import vote_buffer
 from . import auth
 
 # Create a router object
@@ -16,31 +19,38 @@ router = APIRouter(
 )
 
 
+# Vote (dir=1) or remove the vote (dir=0) of the current user on a post
+# One statement in the database, or a place in the next batch of the vote buffer (see votes.py)
 @router.post("/votes", status_code=status.HTTP_201_CREATED)
-async def cast_vote(vote: schemas.VoteStructureBase, db: Session = Depends(get_db), current_user: int = Depends(auth.get_current_user)):
-    post_query = db.query(models.Post).filter(
-        models.Post.id == vote.post_id).first()
-    if not post_query:  # user is trying to vote a post that does not exist
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f'Post {vote.post_id} does not exist')
-
-    vote_query = db.query(models.Vote).filter(
-        models.Vote.post_id == vote.post_id, models.Vote.user_id == current_user.id)
-    if vote.dir == 1:
-        if vote_query.first():  # user has already voted, hence there is a record in the db
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
-                                detail=f'User {current_user.id} has already voted the post {vote.post_id}')
-        # else:   # user has not liked/voted the post before
-            # add the vote to the database
-        new_vote = models.Vote(
-            user_id=current_user.id, post_id=vote.post_id)
-        db.add(new_vote)
-        db.commit()
-        return {"vote message": "successfully voted"}
+async def cast_vote(vote: schemas.VoteStructureBase, db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user)):
+    if vote_buffer.enabled:
+        # the batch is written with a connection of its own: the request must not keep one while it waits,
+        # or the waiting requests could take all the connections of the pool
+        await release_db(db)
+        status_code, detail = await vote_buffer.submit(current_user.id, vote.post_id, vote.dir)
     else:
-        if not vote_query.first():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail=f'Vote does not exist')   # trying to delete a vote/like that does not exist
-        vote_query.delete(synchronize_session=False)
-        db.commit()
-        return {"vote message": "successfully deleted vote"}
+        status_code, detail = await run_db(db, votes.cast_vote, current_user.id, vote.post_id, vote.dir)
+        if status_code == status.HTTP_201_CREATED:
+            await response_cache.post_changed(vote.post_id)
+    if status_code != status.HTTP_201_CREATED:
+        # 404: no such post, or no vote to delete; 409: already voted
+        raise HTTPException(status_code=status_code, detail=detail)
+    return {"vote message": detail}
+
+
+# Cast many votes at once (for the moderation tools)
+# The items are checked in order, like the same number of POST /votes would be
+# (so voting then unvoting the same post in one batch is allowed), and every item gets its own result
+# Only the net changes are written, in one transaction: one multi-row INSERT for the new votes,
+# one DELETE for the removed ones and one (executemany) UPDATE of the vote counts (see votes.py)
+@router.post("/votes/batch", response_model=List[schemas.BulkItemResult])
+async def cast_votes_batch(items: List[schemas.VoteStructureBase], db: Session = Depends(get_write_db), current_user: int = Depends(auth.get_current_user)):
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {settings.bulk_max_items} votes per request')
+    results, changed_posts = await run_db(
+        db, votes.apply_votes, [(current_user.id, vote.post_id, vote.dir) for vote in items])
+    for post_id in changed_posts:
+        await response_cache.post_changed(post_id)
+    return [{"index": index, "status_code": status_code, "detail": detail}
+            for index, (status_code, detail) in enumerate(results)]
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, create_model
 from pydantic.types import conint
-from typing import Optional
+from typing import Optional, Tuple
 from datetime import datetime
 
 
@@ -75,6 +75,7 @@ class ResponseStructureBase(PostStructureBase):
     id: int
     created_at: datetime
     owner_id: int
+    version: int
     owner: UserResponseStructure
 
     # this (taken from documentation) is needed to let the pydantic model response work without dictionary
@@ -91,6 +92,58 @@ class PostVoteStructure(BaseModel):
         orm_mode = True
 
 
+# Sparse fieldsets (the fields= query parameter of GET /posts and GET /posts/{id}):
+# "title,id" -> ("id", "title"), the fields in the order of ResponseStructureBase, None for all of them
+POST_FIELDS = tuple(ResponseStructureBase.__fields__)
+
+
+def post_fields(text: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if not text:
+        return None
+    names = {name.strip() for name in text.split(",") if name.strip()}
+    unknown = names - set(POST_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields {", ".join(sorted(unknown))}, the fields are {", ".join(POST_FIELDS)}')
+    return tuple(name for name in POST_FIELDS if name in names)
+
+
+# PostVoteStructure with only the given fields of the post, made once per set of fields
+# (at most one per subset of POST_FIELDS, the names are checked by post_fields)
+_post_vote_structures = {}
+
+
+def post_vote_structure(fields: Optional[Tuple[str, ...]]):
+    if fields is None:
+        return PostVoteStructure
+    if fields not in _post_vote_structures:
+        post = create_model("PostFields", __config__=ResponseStructureBase.Config,
+                            **{name: (ResponseStructureBase.__fields__[name].outer_type_, None) for name in fields})
+        _post_vote_structures[fields] = create_model("PostVoteFields", __config__=PostVoteStructure.Config,
+                                                     Post=(post, ...), votes=(int, ...))
+    return _post_vote_structures[fields]
+
+
+# A post found by the search, with how well it matches the search
+class PostSearchStructure(BaseModel):
+    Post: ResponseStructureBase
+    rank: float
+
+    class Config:
+        orm_mode = True
+
+
+# Result of one item of a bulk request (POST /posts/bulk, POST /votes/batch)
+# index is the position of the item in the request
+class BulkItemResult(BaseModel):
+    index: int
+    status_code: int
+    detail: Optional[str]
+
+
+class BulkPostResult(BulkItemResult):
+    post: Optional[ResponseStructureBase]
+
+
 # For authentication (login)
 class UserLoginStructure(BaseModel):
     email: EmailStr
@@ -103,7 +156,8 @@ class Token(BaseModel):
 
 
 class TokenData(BaseModel):
-    id: Optional[str]
+    # int, since it is compared against users.id (asyncpg does not cast a str to an integer)
+    id: Optional[int]
 
 
 # Schema for voting
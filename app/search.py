@@ -0,0 +1,133 @@
+# Full-text search over the title and content of the posts
+# Postgres: the posts are matched with a tsvector/tsquery, served by a GIN index
+# (see models.py) and ranked with ts_rank
+# Any other database (e.g. SQLite in tests): an in-process inverted index is used instead
+import re
+import threading
+from collections import defaultdict, namedtuple
+from sqlalchemy import literal_column
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.sql.functions import func
+from . import models
+
+
+# The search document of a post
+# Note this expression needs to be exactly the one of the ix_posts_search index in models.py,
+# otherwise Postgres can not use the index (that is why the literals are not bound parameters)
+SEARCH_CONFIG = literal_column("'english'")
+search_document = func.to_tsvector(
+    SEARCH_CONFIG, models.Post.title + literal_column("' '") + models.Post.content)
+
+
+# Search with the Postgres full-text search
+# returns a list of (post, rank), best match first
+def search_posts_postgres(db: Session, query: str, limit: int):
+    ts_query = func.plainto_tsquery(SEARCH_CONFIG, query)
+    rank = func.ts_rank(search_document, ts_query).label("rank")
+    return db.query(models.Post, rank).filter(search_document.op('@@')(ts_query)).options(
+        selectinload(models.Post.owner)).order_by(rank.desc(), models.Post.id.desc()).limit(limit).all()
+
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str):
+    return [word.lower() for word in _WORD.findall(text)]
+
+
+# In-process inverted index: for every word, the posts containing it and how many times
+# A word in the title counts more than a word in the content
+class InvertedIndex:
+    TITLE_WEIGHT = 2
+
+    def __init__(self):
+        self._postings = defaultdict(dict)     # word -> {post_id: score}
+        self._words = {}                        # post_id -> words of the post
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    # (re)index a post
+    def add(self, post_id: int, title: str, content: str):
+        scores = defaultdict(int)
+        for word in tokenize(title):
+            scores[word] += self.TITLE_WEIGHT
+        for word in tokenize(content):
+            scores[word] += 1
+        with self._lock:
+            self._remove(post_id)
+            for word, score in scores.items():
+                self._postings[word][post_id] = score
+            self._words[post_id] = set(scores)
+
+    def remove(self, post_id: int):
+        with self._lock:
+            self._remove(post_id)
+
+    def _remove(self, post_id: int):
+        for word in self._words.pop(post_id, ()):
+            self._postings[word].pop(post_id, None)
+            if not self._postings[word]:
+                del self._postings[word]
+
+    # Posts containing all the words of the query (like plainto_tsquery)
+    # returns a list of (post_id, score), best match first (newest first for equal scores)
+    def search(self, query: str, limit: int):
+        words = set(tokenize(query))
+        if not words:
+            return []
+        with self._lock:
+            postings = [self._postings.get(word, {}) for word in words]
+            matches = set.intersection(*(set(posting) for posting in postings))
+            scored = [(post_id, sum(posting[post_id] for posting in postings))
+                      for post_id in matches]
+        scored.sort(key=lambda match: (match[1], match[0]), reverse=True)
+        return scored[:limit]
+
+    # Index every post of the database (done once, at the first search)
+    def load(self, db: Session):
+        for post_id, title, content in db.query(models.Post.id, models.Post.title, models.Post.content).yield_per(1000):
+            self.add(post_id, title, content)
+        self.loaded = True
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._words.clear()
+            self.loaded = False
+
+
+index = InvertedIndex()
+
+
+# same attributes as the rows of the Postgres search
+SearchResult = namedtuple("SearchResult", ["Post", "rank"])
+
+
+# Search with the in-process inverted index
+# returns a list of (post, rank), best match first
+def search_posts_memory(db: Session, query: str, limit: int):
+    if not index.loaded:
+        index.load(db)
+    matches = index.search(query, limit)
+    posts = db.query(models.Post).filter(models.Post.id.in_([post_id for post_id, score in matches])).options(
+        selectinload(models.Post.owner)).all()
+    posts_by_id = {post.id: post for post in posts}
+    return [SearchResult(posts_by_id[post_id], score) for post_id, score in matches if post_id in posts_by_id]
+
+
+def search_posts(db: Session, query: str, limit: int):
+    if db.get_bind().dialect.name == "postgresql":
+        return search_posts_postgres(db, query, limit)
+    return search_posts_memory(db, query, limit)
+
+
+# Hooks for the write path of the posts, so that the inverted index follows the changes
+# (only needed once the index has been loaded; Postgres keeps its own index up to date)
+def post_changed(post_id: int, title: str, content: str):
+    if index.loaded:
+        index.add(post_id, title, content)
+
+
+def post_deleted(post_id: int):
+    if index.loaded:
+        index.remove(post_id)
@@ -0,0 +1,44 @@
+# Fast serialization of the database rows for the read endpoints
+# The usual path validates every ORM object again with its pydantic schema (orm_mode),
+# then jsonable_encoder converts the models to dicts and the stdlib json encodes them
+# The rows come straight from our own database, so there is nothing to validate:
+# dump() just copies the fields of the schema from the object into plain dicts
+# (the schema still decides which fields are returned, e.g. never the password)
+# and orjson encodes them (it handles datetimes itself)
+import orjson
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+
+# schema -> [(field name, nested schema or None, is a list)], computed once per schema
+_plans = {}
+
+
+def _plan(schema):
+    if schema not in _plans:
+        plan = []
+        for name, field in schema.__fields__.items():
+            nested = field.type_ if isinstance(field.type_, type) and issubclass(field.type_, BaseModel) else None
+            if nested is not None and field.shape not in (SHAPE_SINGLETON, SHAPE_LIST):
+                raise TypeError(f'{schema.__name__}.{name}: only single or list nested models can be dumped')
+            plan.append((name, nested, field.shape == SHAPE_LIST))
+        _plans[schema] = plan
+    return _plans[schema]
+
+
+# one object (ORM object, row, ...) with the fields of schema, as a dict
+def dump(schema, obj):
+    data = {}
+    for name, nested, is_list in _plan(schema):
+        value = getattr(obj, name)
+        if nested is not None and value is not None:
+            value = [dump(nested, item) for item in value] if is_list else dump(nested, value)
+        data[name] = value
+    return data
+
+
+def dump_list(schema, objs):
+    return [dump(schema, obj) for obj in objs]
+
+
+def render(data) -> bytes:
+    return orjson.dumps(data)
@@ -0,0 +1,62 @@
+# Slow-query log
+# Every SQL statement taking longer than slow_query_threshold_ms is logged (with its bound parameters
+# and the route of the request it came from) and kept in a ring buffer, read by GET /internal/slow-queries
+# For a sample of the slow SELECTs (slow_query_explain_sample_rate), the plan is captured too,
+# with EXPLAIN (ANALYZE, BUFFERS), so we can see why the query is slow
+import logging
+import random
+from collections import deque
+from datetime import datetime, timezone
+from .config import settings
+from .metrics import route_of
+
+logger = logging.getLogger("app.slow_queries")
+
+slow_queries = deque(maxlen=settings.slow_query_buffer_size)
+
+
+def is_slow(seconds: float):
+    return seconds * 1000 >= settings.slow_query_threshold_ms
+
+
+# the parameters of the statements about passwords are not logged
+def loggable_parameters(statement: str, parameters):
+    if "password" in statement:
+        return "<redacted>"
+    return repr(parameters)
+
+
+# EXPLAIN (ANALYZE, BUFFERS) runs the statement again, so only SELECTs are explained
+# It runs on a new cursor of the same connection (the results of the original cursor are not read yet),
+# inside a savepoint, so an error here can not break the transaction of the request
+def explain(conn, statement: str, parameters):
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as err:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            plan = f'EXPLAIN failed: {err}'
+        cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        cursor.close()
+
+
+# Called for every statement slower than the threshold (see database.py)
+# request: the request the statement came from, if any
+def record(conn, statement: str, parameters, executemany: bool, seconds: float, request):
+    route = f'{request.method} {route_of(request)}' if request is not None else None
+    entry = {"time": datetime.now(timezone.utc).isoformat(), "duration_ms": round(seconds * 1000, 3),
+             "route": route, "statement": statement,
+             "parameters": loggable_parameters(statement, parameters), "plan": None}
+    logger.warning("slow query (%.1f ms, %s): %s %s", entry["duration_ms"], route, statement,
+                   entry["parameters"])
+    if (settings.slow_query_explain_sample_rate > 0 and not executemany
+            and conn.dialect.name == "postgresql"
+            and statement.lstrip().upper().startswith("SELECT")
+            and random.random() < settings.slow_query_explain_sample_rate):
+        entry["plan"] = explain(conn, statement, parameters)
+    slow_queries.append(entry)
@@ -1,6 +1,18 @@
+import asyncio
+import base64
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
+from .config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# The cost factor (rounds) of bcrypt comes from the settings
+# min and max rounds are the same, so that a hash made with another cost "needs an update"
+# and is rehashed with the new cost at the next login of the user (see verify_and_update_password)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds,
+                           bcrypt__max_rounds=settings.bcrypt_rounds)
 
 
 # hash the password
@@ -15,4 +27,107 @@ def verify_password(input_pass, db_pass):
     return pwd_context.verify(input_pass, db_pass)
 
 
+# returns (verification status, new hash or None if the stored hash does not need an update)
+def verify_and_update(input_pass, db_pass):
+    return pwd_context.verify_and_update(input_pass, db_pass)
 
+
+# Hashing/verifying a password with bcrypt takes a few hundred ms of CPU
+# Done directly in an async handler, it would freeze every other request of the worker
+# So the password work is sent to a pool of workers (threads or processes, see the settings)
+# At most password_workers + password_queue_size jobs can be waiting for the pool,
+# any more and the request is answered with a 429 straight away instead of piling up
+class PasswordPool:
+    def __init__(self, kind: str, workers: int, queue_size: int):
+        self.kind = kind
+        self.workers = workers
+        self.limit = workers + queue_size
+        self.pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        # created at the first use, so that importing the app does not start any process
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="password")
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.limit:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail=f'Too many password operations in progress, try again later',
+                                headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+
+password_pool = PasswordPool(settings.password_executor, settings.password_workers,
+                             settings.password_queue_size)
+
+
+# async versions of hash_function and verify_and_update, run in the password pool
+async def hash_password_async(password: str):
+    return await password_pool.run(hash_function, password)
+
+
+async def verify_and_update_password(input_pass, db_pass):
+    return await password_pool.run(verify_and_update, input_pass, db_pass)
+
+
+# Cursors for the keyset pagination of the posts
+# The cursor is the (created_at, id) of the last post of a page, encoded in base64
+# so that the client just passes it back as it is to get the next page
+def encode_cursor(created_at: datetime, id: int):
+    raw = f'{created_at.isoformat()}|{id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+# returns the (created_at, id) pair, or raises a ValueError for a malformed cursor
+def decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    created_at, id = raw.split('|')
+    return datetime.fromisoformat(created_at), int(id)
+
+
+# ETag of a post: its version (bumped by every edit) and its number of votes
+# (the votes are part of the response, so a new vote has to change the ETag for the conditional GETs)
+# a response with only some of the fields of the post (fields=) is another representation, with its own tag
+def post_etag(version: int, votes: int, fields=None):
+    if fields is not None:
+        return f'"{version}.{votes}.{"+".join(fields)}"'
+    return f'"{version}.{votes}"'
+
+
+# The versions listed in an If-Match header, e.g. '"3.10", W/"4.2"' -> {3, 4}, or None for "*" (any version)
+# Only the version is compared: a vote in between does not conflict with an edit
+# A weak tag is accepted: it is our own version token, made weak by the compression of the response
+# (see compression.py), the version it names is the same
+# Malformed tags never match
+def if_match_versions(header: str):
+    if header.strip() == "*":
+        return None
+    versions = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.startswith('"') and tag.endswith('"'):
+            try:
+                versions.add(int(tag.strip('"').split(".")[0]))
+            except ValueError:
+                pass
+    return versions
+
+
+# If-None-Match of a conditional GET (weak comparison)
+def etag_matches(header: str, etag: str):
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip().replace("W/", "", 1) for tag in header.split(",")}
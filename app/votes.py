@@ -0,0 +1,263 @@
+# Writing the votes (see routers/vote.py)
+#
+# A single vote is one statement: the vote is inserted (or deleted) and the vote_count of the post
+# is changed in the same statement (a data-modifying CTE), e.g. for a new vote:
+#   WITH new_vote AS (INSERT INTO votes (user_id, post_id) SELECT :user_id, posts.id FROM posts
+#                     WHERE posts.id = :post_id ON CONFLICT DO NOTHING RETURNING votes.post_id)
+#   UPDATE posts SET vote_count = vote_count + 1 WHERE posts.id IN (SELECT post_id FROM new_vote) RETURNING posts.id
+# ON CONFLICT DO NOTHING: two requests voting at the same time can not both insert the vote (or fail on the
+# primary key), and the count only moves when a vote was really inserted or deleted
+# Only when nothing changed, one more query tells why (no such post, already voted, no vote to delete)
+# Other databases (e.g. the SQLite stand-in of the load test) can not compile these statements (RETURNING):
+# there the vote is checked, then written, in one transaction, and a vote inserted meanwhile by another
+# request fails on the primary key (IntegrityError) and is a conflict like above
+#
+# Many votes (POST /votes/batch, the vote buffer) are applied by apply_votes: one query for the current state,
+# then only the net changes are written, one multi-row INSERT, one DELETE and one UPDATE of the counts
+# (on the other databases, the counts follow the changes computed from the state read in the same transaction)
+#
+# Vote buffer (vote_buffer_ms in the settings, 0 to switch it off):
+# the votes of all the requests are gathered for up to vote_buffer_ms (or until vote_buffer_size are waiting)
+# and written together by apply_votes, so a burst of votes on a hot post costs one UPDATE of its row
+# instead of one per vote (all waiting for the lock of that row)
+# A request still waits for the write of its vote and gets its real answer (201, 404, 409)
+# When writing the batch fails (e.g. a post deleted between the read of the state and the INSERT, a serialization
+# failure), its votes are written again one by one (cast_vote), so only a vote which fails again gets an error
+import asyncio
+from collections import Counter
+from sqlalchemy import bindparam, delete, insert, literal, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import Session
+from fastapi import status
+from . import models
+from .config import settings
+from .database import open_db, run_db
+from .response_cache import response_cache
+
+VOTED = "successfully voted"
+UNVOTED = "successfully deleted vote"
+NO_VOTE = "Vote does not exist"
+
+
+def _already_voted(user_id: int, post_id: int):
+    return f'User {user_id} has already voted the post {post_id}'
+
+
+def _no_post(post_id: int):
+    return f'Post {post_id} does not exist'
+
+
+# (synchronize_session=False: the rows are not in the session, nothing to keep in sync)
+def _count_change(changed_posts, delta: int):
+    return update(models.Post).where(models.Post.id.in_(select(changed_posts.c.post_id))).values(
+        vote_count=models.Post.vote_count + delta).returning(models.Post.id).execution_options(synchronize_session=False)
+
+
+def _is_postgres(db: Session):
+    return db.get_bind().dialect.name == "postgresql"
+
+
+# One vote of user_id, returns (status code, detail)
+def cast_vote(db: Session, user_id: int, post_id: int, dir: int):
+    if not _is_postgres(db):
+        changed = _write_vote(db, user_id, post_id, dir)
+    elif dir == 1:
+        new_vote = pg_insert(models.Vote).from_select(
+            ["user_id", "post_id"], select(literal(user_id), models.Post.id).where(models.Post.id == post_id)
+        ).on_conflict_do_nothing().returning(models.Vote.post_id).cte("new_vote")
+        changed = db.execute(_count_change(new_vote, 1)).first()
+    else:
+        old_vote = delete(models.Vote).where(models.Vote.user_id == user_id, models.Vote.post_id == post_id).returning(
+            models.Vote.post_id).cte("old_vote")
+        changed = db.execute(_count_change(old_vote, -1)).first()
+    db.commit()
+    if changed:
+        return status.HTTP_201_CREATED, VOTED if dir == 1 else UNVOTED
+
+    if db.execute(select(models.Post.id).where(models.Post.id == post_id)).first() is None:
+        return status.HTTP_404_NOT_FOUND, _no_post(post_id)
+    if dir == 1:
+        return status.HTTP_409_CONFLICT, _already_voted(user_id, post_id)
+    return status.HTTP_404_NOT_FOUND, NO_VOTE
+
+
+# The vote checked then written, for the databases without RETURNING
+# returns True when it changed something, False when not (cast_vote then looks up the reason)
+def _write_vote(db: Session, user_id: int, post_id: int, dir: int):
+    vote = (models.Vote.user_id == user_id, models.Vote.post_id == post_id)
+    if dir == 1:
+        if db.execute(select(models.Post.id).where(models.Post.id == post_id)).first() is None \
+                or db.execute(select(models.Vote.post_id).where(*vote)).first() is not None:
+            db.rollback()
+            return False
+        db.execute(insert(models.Vote).values(user_id=user_id, post_id=post_id))
+    elif db.execute(delete(models.Vote).where(*vote).execution_options(synchronize_session=False)).rowcount == 0:
+        db.rollback()
+        return False
+    db.execute(update(models.Post).where(models.Post.id == post_id).values(
+        vote_count=models.Post.vote_count + (1 if dir == 1 else -1)).execution_options(synchronize_session=False))
+    try:
+        db.commit()
+    except IntegrityError:
+        # cast meanwhile by another request (or the post was deleted meanwhile)
+        db.rollback()
+        return False
+    return True
+
+
+# Many votes [(user_id, post_id, dir)], checked in order like the same number of single votes would be
+# (so voting then unvoting the same post in one go is allowed)
+# returns the (status code, detail) of every vote, and the posts whose vote_count changed
+def apply_votes(db: Session, votes):
+    post_ids = {post_id for user_id, post_id, dir in votes}
+    pairs = {(user_id, post_id) for user_id, post_id, dir in votes}
+    existing_posts = set(db.execute(select(models.Post.id).where(models.Post.id.in_(post_ids))).scalars())
+    voted_before = {(user_id, post_id) for user_id, post_id in db.execute(
+        select(models.Vote.user_id, models.Vote.post_id).where(
+            tuple_(models.Vote.user_id, models.Vote.post_id).in_(pairs)))}
+
+    voted = set(voted_before)
+    results = []
+    for user_id, post_id, dir in votes:
+        if post_id not in existing_posts:
+            results.append((status.HTTP_404_NOT_FOUND, _no_post(post_id)))
+        elif dir == 1 and (user_id, post_id) in voted:
+            results.append((status.HTTP_409_CONFLICT, _already_voted(user_id, post_id)))
+        elif dir == 1:
+            voted.add((user_id, post_id))
+            results.append((status.HTTP_201_CREATED, VOTED))
+        elif (user_id, post_id) not in voted:
+            results.append((status.HTTP_404_NOT_FOUND, NO_VOTE))
+        else:
+            voted.discard((user_id, post_id))
+            results.append((status.HTTP_201_CREATED, UNVOTED))
+
+    # the counts only follow the rows really inserted/deleted
+    # (a vote cast meanwhile by another request is skipped, and not counted twice)
+    # the rows are written in the order of the primary key, like the counts below, so two batches
+    # (two flushes of the vote buffer, a flush and a POST /votes/batch) can not wait for each other's rows
+    deltas = Counter()
+    added = sorted(voted - voted_before)
+    removed = sorted(voted_before - voted)
+    if _is_postgres(db):
+        if added:
+            for post_id in db.execute(pg_insert(models.Vote).values(
+                    [{"user_id": user_id, "post_id": post_id} for user_id, post_id in added]
+            ).on_conflict_do_nothing().returning(models.Vote.post_id)).scalars():
+                deltas[post_id] += 1
+        if removed:
+            for post_id in db.execute(delete(models.Vote).where(
+                    tuple_(models.Vote.user_id, models.Vote.post_id).in_(removed)).returning(
+                    models.Vote.post_id).execution_options(synchronize_session=False)).scalars():
+                deltas[post_id] -= 1
+    else:
+        if added:
+            db.execute(insert(models.Vote).values([{"user_id": user_id, "post_id": post_id}
+                                                   for user_id, post_id in added]))
+        if removed:
+            db.execute(delete(models.Vote).where(tuple_(models.Vote.user_id, models.Vote.post_id).in_(
+                removed)).execution_options(synchronize_session=False))
+        deltas.update(post_id for user_id, post_id in added)
+        deltas.subtract(post_id for user_id, post_id in removed)
+    deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+    if deltas:
+        # always in the order of the ids, for the same reason
+        db.execute(update(models.Post).where(models.Post.id == bindparam("changed_id")).values(
+            vote_count=models.Post.vote_count + bindparam("delta")),
+            [{"changed_id": post_id, "delta": deltas[post_id]} for post_id in sorted(deltas)])
+    db.commit()
+    return results, set(deltas)
+
+
+# The votes of a batch one by one, when apply_votes failed for the whole batch
+# returns the (status code, detail) or the error of every vote, and the posts whose vote_count changed
+def cast_votes_one_by_one(db: Session, votes):
+    results, changed_posts = [], set()
+    for user_id, post_id, dir in votes:
+        try:
+            result = cast_vote(db, user_id, post_id, dir)
+        except DBAPIError as error:
+            db.rollback()
+            result = error
+        if result == (status.HTTP_201_CREATED, VOTED if dir == 1 else UNVOTED):
+            changed_posts.add(post_id)
+        results.append(result)
+    return results, changed_posts
+
+
+# The votes of a batch of the vote buffer, together, or one by one when that fails
+def write_votes(db: Session, votes):
+    try:
+        return apply_votes(db, votes)
+    except DBAPIError:
+        db.rollback()
+    return cast_votes_one_by_one(db, votes)
+
+
+class VoteBuffer:
+    def __init__(self, delay_ms: float, max_size: int):
+        self.delay = delay_ms / 1000
+        self.max_size = max_size
+        self._pending = []          # (user_id, post_id, dir, future)
+        self._timer = None
+        self._flushes = set()       # the flushes running (a task is only weakly referenced by the loop)
+        self.flushes = 0
+        self.votes = 0
+
+    @property
+    def enabled(self):
+        return self.delay > 0
+
+    # waits until the vote is written, returns its (status code, detail)
+    async def submit(self, user_id: int, post_id: int, dir: int):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((user_id, post_id, dir, future))
+        if len(self._pending) >= self.max_size:
+            self._flush_soon(0)
+        elif self._timer is None:
+            self._flush_soon(self.delay)
+        return await future
+
+    def _flush_soon(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        self.flushes += 1
+        self.votes += len(pending)
+        try:
+            async with open_db() as db:
+                results, changed_posts = await run_db(db, write_votes, [vote[:3] for vote in pending])
+        except Exception as error:
+            for *vote, future in pending:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for post_id in changed_posts:
+            await response_cache.post_changed(post_id)
+        for (*vote, future), result in zip(pending, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {"enabled": self.enabled, "delay_ms": self.delay * 1000, "max_size": self.max_size,
+                "pending": len(self._pending), "flushes": self.flushes, "votes": self.votes,
+                "votes_per_flush": self.votes / self.flushes if self.flushes else 0.0}
+
+
+vote_buffer = VoteBuffer(settings.vote_buffer_ms, settings.vote_buffer_size)
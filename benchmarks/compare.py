@@ -0,0 +1,53 @@
+# Compares two load test reports (see loadtest.py), e.g. the one of the main branch and the one of a change
+# For every endpoint: the throughput and the p50/p95/p99 latency, before -> after, and the change in %
+# Exits with status 1 when an endpoint got slower than the threshold (p95 up, or throughput down)
+# Run it with: python -m benchmarks.compare before.json after.json --threshold 10
+import argparse
+import sys
+import orjson
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(before: dict, after: dict, threshold: float):
+    rows = []
+    regressions = []
+    for endpoint in [*sorted(set(before["endpoints"]) & set(after["endpoints"])), "total"]:
+        old = before["total"] if endpoint == "total" else before["endpoints"][endpoint]
+        new = after["total"] if endpoint == "total" else after["endpoints"][endpoint]
+        changes = {metric: change(old[metric], new[metric])
+                   for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")}
+        rows.append((endpoint, old, new, changes))
+        if (changes["p95_ms"] or 0) > threshold or (changes["throughput_rps"] or 0) < -threshold:
+            regressions.append(endpoint)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares two load test reports")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="regression threshold, in %%")
+    args = parser.parse_args(argv)
+    with open(args.before, "rb") as file:
+        before = orjson.loads(file.read())
+    with open(args.after, "rb") as file:
+        after = orjson.loads(file.read())
+
+    print(f'before: {before["meta"]["commit"]}  after: {after["meta"]["commit"]}')
+    rows, regressions = compare(before, after, args.threshold)
+    for endpoint, old, new, changes in rows:
+        cells = "  ".join(f'{metric} {old[metric]:.2f} -> {new[metric]:.2f} ({changes[metric]:+.1f}%)'
+                          for metric in changes if changes[metric] is not None)
+        print(f'{endpoint:<18} {cells}')
+    if regressions:
+        print(f'slower by more than {args.threshold}%: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Generator of production-shaped data, to size the indexes and the caches
+# - users: all with the same password (hashed once), created over the past year
+# - posts: a few users write most of the posts (Zipf), created one after the other over the past year
+# - votes: a few posts get most of the votes (Zipf), at most one vote per user and post
+# The rows are built for models.User/Post/Vote with explicit ids (after the ones already in the tables)
+# and loaded with COPY on Postgres, or with batched inserts on any other database
+# On Postgres the secondary indexes and the foreign keys are dropped during the load and created
+# again at the end (see drop_constraints), which makes the load many times faster
+# The data only depends on --seed, and the users follow the naming of seed.py,
+# so the load test (loadtest.py) runs on a generated dataset when given the same seed
+#
+# Run it with: python -m benchmarks.generate --users 100000 --posts 5000000 --votes 20000000 --seed 1
+import argparse
+import csv
+import io
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from math import gcd
+from random import Random
+from sqlalchemy import create_engine, insert, inspect, select, text
+from sqlalchemy.schema import AddConstraint, CreateIndex
+from sqlalchemy.sql.functions import func
+from app import database, models, utils
+from . import seed as seeding
+
+WORDS = ("fastapi python postgres index cache query async database api token vote post user "
+         "pagination search latency throughput benchmark deploy docker test migration pool").split()
+SPAN = timedelta(days=365)
+
+
+# Zipf weights 1/rank^s, as cumulative weights (for Random.choices)
+def zipf_cum_weights(n: int, s: float):
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+# number of votes of every post (in the order of the post ids), adding up to `votes`
+# (a post can not get more votes than there are users, the rest goes to the next posts)
+# the popularity ranks are scattered over the posts (rank r -> post r * step % posts),
+# so the popular posts are not all the oldest ones
+def vote_counts(posts: int, users: int, votes: int, s: float):
+    counts = array("l", [0]) * posts
+    if not posts or not users:
+        return counts
+    total = sum(1 / rank ** s for rank in range(1, posts + 1))
+    step = _coprime_step(posts)
+    carry = 0.0
+    for rank in range(1, posts + 1):
+        carry += votes / total / rank ** s
+        count = min(int(carry + 1e-9), users)     # (+ 1e-9: the float sum of the shares may fall just short)
+        carry -= count
+        counts[(rank * step) % posts] = count
+    return counts
+
+
+def _coprime_step(n: int):
+    step = max(1, int(n * 0.618))
+    while gcd(step, n) != 1:
+        step += 1
+    return step
+
+
+class Generator:
+    def __init__(self, users: int, posts: int, votes: int, seed: int = 0, zipf: float = 1.1,
+                 first_user_id: int = 1, first_post_id: int = 1):
+        self.users, self.posts, self.votes = users, posts, votes
+        self.seed = seed
+        self.zipf = zipf
+        self.first_user_id, self.first_post_id = first_user_id, first_post_id
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.password = utils.hash_function(seeding.PASSWORD)
+
+    def user_rows(self):
+        rng = Random(f'{self.seed}-users')
+        prefix = seeding.email_prefix(self.seed)
+        for i in range(self.users):
+            yield {"id": self.first_user_id + i, "email": f'{prefix}{i}@example.com', "password": self.password,
+                   "name": f'Benchmark user {i}', "created_at": self.now - SPAN * rng.random(), "follower_count": 0}
+
+    def post_rows(self, counts):
+        rng = Random(f'{self.seed}-posts')
+        owners = zipf_cum_weights(self.users, self.zipf)
+        start = self.now - SPAN
+        for i in range(self.posts):
+            words = rng.choices(WORDS, k=12)
+            yield {"id": self.first_post_id + i, "title": " ".join(words[:4]), "content": " ".join(words),
+                   "rating": rng.randint(1, 5), "published": True,
+                   "created_at": start + SPAN * (i / self.posts),
+                   "owner_id": self.first_user_id + rng.choices(range(self.users), cum_weights=owners)[0],
+                   "vote_count": counts[i], "version": 1}
+
+    def vote_rows(self, counts):
+        rng = Random(f'{self.seed}-votes')
+        for i, count in enumerate(counts):
+            for user in rng.sample(range(self.users), count):
+                yield {"user_id": self.first_user_id + user, "post_id": self.first_post_id + i}
+
+
+def _columns(table):
+    return [column.name for column in table.columns]
+
+
+# COPY ... FROM STDIN (csv), `batch_size` rows at a time
+def copy_rows(connection, table, rows, batch_size: int):
+    columns = _columns(table)
+    sql = f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+    cursor = connection.cursor()
+    count = 0
+    while True:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        written = 0
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+            written += 1
+            if written == batch_size:
+                break
+        if not written:
+            break
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+        count += written
+    cursor.close()
+    return count
+
+
+def insert_rows(connection, table, rows, batch_size: int):
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            connection.execute(insert(table), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+        count += len(batch)
+    return count
+
+
+# The secondary indexes and the foreign keys of posts and votes are dropped during a load and
+# created again at the end: one sort (or one join) per index (or foreign key), instead of one index
+# update and one foreign key check per row (the primary keys and unique constraints are kept)
+_DEFERRED_TABLES = (models.Post.__table__, models.Vote.__table__)
+
+
+def drop_constraints(conn):
+    for table in _DEFERRED_TABLES:
+        for foreign_key in inspect(conn).get_foreign_keys(table.name):
+            conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT {foreign_key["name"]}'))
+        for index in table.indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    conn.execute(text("DROP INDEX IF EXISTS ix_posts_search"))
+
+
+def create_constraints(conn, maintenance_work_mem: str = "512MB", log=print):
+    def timed(name, statement):
+        start = time.perf_counter()
+        conn.execute(statement)
+        log(f'{name}: built in {time.perf_counter() - start:.1f}s')
+
+    # more memory for the index builds than the default 64MB (the GIN index needs it most)
+    conn.execute(text(f"SET LOCAL maintenance_work_mem = '{maintenance_work_mem}'"))
+    for table in _DEFERRED_TABLES:
+        for foreign_key in table.foreign_key_constraints:
+            timed(f'{table.name}.{foreign_key.column_keys[0]} foreign key', AddConstraint(foreign_key))
+        for index in table.indexes:
+            timed(index.name, CreateIndex(index))
+    timed("ix_posts_search", text(models.SEARCH_INDEX_DDL))
+
+
+def generate(engine, users: int, posts: int, votes: int, seed: int = 0, zipf: float = 1.1,
+             batch_size: int = 100000, defer_constraints: bool = True, maintenance_work_mem: str = "512MB",
+             log=print):
+    with engine.connect() as conn:
+        if conn.execute(select(models.User.id).where(
+                models.User.email.like(seeding.email_prefix(seed) + '%')).limit(1)).first():
+            raise ValueError(f'The database already has the users of the seed {seed}')
+        first_user_id = (conn.execute(select(func.max(models.User.id))).scalar() or 0) + 1
+        first_post_id = (conn.execute(select(func.max(models.Post.id))).scalar() or 0) + 1
+
+    generator = Generator(users, posts, votes, seed, zipf, first_user_id, first_post_id)
+    counts = vote_counts(posts, users, votes, zipf)
+    tables = [(models.User.__table__, generator.user_rows()),
+              (models.Post.__table__, generator.post_rows(counts)),
+              (models.Vote.__table__, generator.vote_rows(counts))]
+    postgres = engine.dialect.name == "postgresql"
+
+    # everything happens in one transaction: if the load fails, the tables are left as they were
+    # (with their indexes and foreign keys)
+    with engine.begin() as conn:
+        if postgres and defer_constraints:
+            drop_constraints(conn)
+        for table, rows in tables:
+            start = time.perf_counter()
+            if postgres:
+                # COPY goes through the psycopg2 connection itself
+                count = copy_rows(conn.connection, table, rows, batch_size)
+            else:
+                count = insert_rows(conn, table, rows, batch_size)
+            log(f'{table.name}: {count} rows in {time.perf_counter() - start:.1f}s')
+        if postgres:
+            if defer_constraints:
+                create_constraints(conn, maintenance_work_mem, log)
+            # the ids were given explicitly, the sequences have to catch up
+            for table in ("users", "posts"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                  f"(SELECT max(id) FROM {table}))"))
+
+    if postgres:
+        # fresh statistics for the planner
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE users, posts, votes"))
+    return sum(counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates users, posts and votes")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--votes", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponent of the Zipf distributions")
+    parser.add_argument("--batch-size", type=int, default=100000, help="rows per COPY/INSERT")
+    parser.add_argument("--keep-constraints", action="store_true",
+                        help="keep the indexes and foreign keys during the load (Postgres), "
+                             "e.g. to add a few rows to big tables")
+    parser.add_argument("--maintenance-work-mem", default="512MB", help="memory of the index builds (Postgres)")
+    parser.add_argument("--database", help="default: the database of the .env file")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database or database.SQLALCHEMY_DB_URL)
+    start = time.perf_counter()
+    votes = generate(engine, args.users, args.posts, args.votes, args.seed, args.zipf, args.batch_size,
+                     defer_constraints=not args.keep_constraints,
+                     maintenance_work_mem=args.maintenance_work_mem)
+    print(f'{args.users} users, {args.posts} posts, {votes} votes in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == "__main__":
+    main()
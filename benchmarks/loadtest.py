@@ -0,0 +1,325 @@
+# Load test of the main endpoints
+# 1. seeds the database with users, posts and votes at the given scale (see seed.py)
+# 2. runs a scripted mix of requests on GET /posts, GET /posts/{id}, POST /votes, POST /login,
+#    GET /users/{id} and POST /users, with a number of concurrent clients (GET /feed can be added with --mix)
+# 3. writes the throughput and the p50/p95/p99 latency of every endpoint to a JSON file,
+#    to compare with another run with: python -m benchmarks.compare old.json new.json
+# The script only depends on --seed, so two runs with the same options send the same requests
+#
+# Targets:
+# - in-process (default): the requests are sent straight to the app, no server or network is involved,
+#   on the database of the .env file (Postgres), or on a SQLite stand-in with --database sqlite:///bench.db
+# - a running server with --url http://127.0.0.1:8000 (it needs the same .env, the tokens are made here)
+#
+# Run it with: python -m benchmarks.loadtest --users 100 --posts 10000 --votes 50000 --requests 5000
+import argparse
+import asyncio
+import math
+import os
+import subprocess
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from random import Random
+from typing import Optional
+import orjson
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import database
+from app.config import settings
+from app.routers.auth import create_access_token
+from . import seed as seeding
+
+# endpoint -> weight in the mix
+DEFAULT_MIX = {"GET /posts": 30, "GET /posts/{id}": 30, "POST /votes": 20,
+               "POST /login": 5, "GET /users/{id}": 10, "POST /users": 5}
+
+
+@dataclass
+class Op:
+    endpoint: str
+    method: str
+    path: str
+    user: int = 0                   # index of the user sending the request (the bearer token)
+    json: Optional[dict] = None
+
+
+# The requests of a run, drawn from the mix
+# A few posts get most of the reads and votes (the popular posts), like in production
+def script(dataset: seeding.Dataset, mix: dict, count: int, seed: int):
+    rng = Random(seed)
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+
+    def popular_post():
+        return dataset.post_ids[int(len(dataset.post_ids) * rng.random() ** 3)]
+
+    ops = []
+    for endpoint in rng.choices(endpoints, weights, k=count):
+        user = rng.randrange(len(dataset.user_ids))
+        if endpoint == "GET /posts":
+            ops.append(Op(endpoint, "GET", f'/posts?limit={rng.choice((5, 10, 20))}', user))
+        elif endpoint == "GET /posts/{id}":
+            ops.append(Op(endpoint, "GET", f'/posts/{popular_post()}', user))
+        elif endpoint == "POST /votes":
+            ops.append(Op(endpoint, "POST", '/votes', user, {"post_id": popular_post(), "dir": rng.choice((0, 1))}))
+        elif endpoint == "POST /login":
+            ops.append(Op(endpoint, "POST", '/login', user,
+                          {"email": dataset.emails[user], "password": seeding.PASSWORD}))
+        elif endpoint == "GET /users/{id}":
+            ops.append(Op(endpoint, "GET", f'/users/{rng.choice(dataset.user_ids)}', user))
+        elif endpoint == "GET /feed":
+            ops.append(Op(endpoint, "GET", f'/feed?limit={rng.choice((10, 20))}', user))
+        elif endpoint == "POST /users":
+            # the email is made unique when the request is sent, so the run can be repeated
+            ops.append(Op(endpoint, "POST", '/users', user,
+                          {"email": None, "password": seeding.PASSWORD, "name": "Load test user"}))
+        else:
+            raise ValueError(f'Unknown endpoint in the mix: {endpoint}')
+    return ops
+
+
+# Sends the requests straight to the ASGI app, in the current event loop
+class AppClient:
+    name = "in-process"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        path, _, query = path.partition("?")
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+                 "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+                 "root_path": "", "client": ("127.0.0.1", 0), "server": ("loadtest", 80),
+                 "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()]}
+        status = None
+        done = asyncio.Event()
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                done.set()
+
+        await self.app(scope, receive, send)
+        return status
+
+    def close(self):
+        pass
+
+
+# Sends the requests to a running server (one HTTP session per client thread)
+class HttpClient:
+    def __init__(self, url: str, concurrency: int):
+        import requests
+        import threading
+        self.name = url
+        self.url = url.rstrip("/")
+        self._requests = requests
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(concurrency)
+
+    def _send(self, method, path, headers, body):
+        if not hasattr(self._local, "session"):
+            self._local.session = self._requests.Session()
+        return self._local.session.request(method, self.url + path, headers=headers, data=body).status_code
+
+    async def request(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._send, method, path, headers, body)
+
+    def close(self):
+        self._executor.shutdown()
+
+
+# nearest-rank percentile of sorted values
+def percentile(values, q: float):
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, statuses, errors, seconds: float):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": dict(sorted(statuses.items())),
+        "throughput_rps": len(latencies) / seconds if seconds else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def json_of(op: Op):
+    if op.endpoint == "POST /users":
+        return {**op.json, "email": f'loadtest-{uuid.uuid4().hex}@example.com'}
+    return op.json
+
+
+# Runs the ops with `concurrency` clients, each one taking the next op of the script
+# Only the ops after the first `warmup` ones are measured
+# An error is a 5xx or a failed request (4xx are expected answers, e.g. voting twice)
+# The answers are counted by status code (as a string, like in the JSON report), and "failed" for no answer
+async def run(client, dataset: seeding.Dataset, ops, concurrency: int, warmup: int = 0):
+    tokens = [create_access_token({"user_id": user_id}) for user_id in dataset.user_ids]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    errors = Counter()
+    queue = iter(enumerate(ops))
+    started = None
+
+    async def worker():
+        nonlocal started
+        for index, op in queue:
+            if index == warmup:
+                started = time.perf_counter()
+            headers = {"Authorization": f'Bearer {tokens[op.user]}'}
+            body = b""
+            if op.json is not None:
+                headers["Content-Type"] = "application/json"
+                body = orjson.dumps(json_of(op))
+            start = time.perf_counter()
+            try:
+                status = await client.request(op.method, op.path, headers, body)
+            except Exception:
+                status = None
+            seconds = time.perf_counter() - start
+            if index < warmup:
+                continue
+            latencies[op.endpoint].append(seconds)
+            statuses[op.endpoint][str(status) if status is not None else "failed"] += 1
+            if status is None or status >= 500:
+                errors[op.endpoint] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started if started is not None else 0.0
+    all_latencies = [latency for endpoint in latencies for latency in latencies[endpoint]]
+    return {
+        "duration_seconds": seconds,
+        "total": summarize(all_latencies, sum(statuses.values(), Counter()), sum(errors.values()), seconds),
+        "endpoints": {endpoint: summarize(latencies[endpoint], statuses[endpoint], errors[endpoint], seconds)
+                      for endpoint in sorted(latencies)},
+    }
+
+
+# creates (or upgrades) the schema of the database with the migrations
+def migrate(url: str):
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "..", "alembic"))
+    config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+    command.upgrade(config, "head")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text: str):
+    mix = {}
+    for part in text.split(","):
+        endpoint, _, weight = part.rpartition("=")
+        mix[endpoint.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the main endpoints")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--votes", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100, help="requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help='weights of the endpoints, e.g. "GET /posts=50,POST /votes=50"')
+    parser.add_argument("--database", help="database to seed and serve, e.g. sqlite:///bench.db "
+                                           "(default: the database of the .env file)")
+    parser.add_argument("--url", help="load test a running server instead of the app in-process")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the rate limits of the app in-process (a load test is one abusive client)")
+    parser.add_argument("--output", default="loadtest.json")
+    args = parser.parse_args(argv)
+
+    # the schema of the database, by the migrations
+    url = args.database or database.SQLALCHEMY_DB_URL
+    migrate(url)
+
+    engine = create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+    SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    with SessionLocal() as db:
+        try:
+            dataset = seeding.seed(db, args.users, args.posts, args.votes, args.seed)
+        except seeding.ScaleMismatch as error:
+            parser.error(str(error))
+    if not dataset.user_ids or not dataset.post_ids:
+        parser.error("the benchmark needs at least one user and one post")
+    ops = script(dataset, args.mix, args.warmup + args.requests, args.seed)
+
+    if args.url:
+        client = HttpClient(args.url, args.concurrency)
+    else:
+        from app.main import create_app
+        from app.ratelimit import rate_limiter
+        app = create_app()
+        if not args.rate_limits:
+            rate_limiter.limits = {}
+        if args.database:
+            # the app serves the stand-in database (in the threadpool, like the sync mode)
+            def get_db():
+                db = SessionLocal()
+                try:
+                    yield db
+                finally:
+                    db.close()
+            for dependency in (database.get_db, database.get_read_db, database.get_write_db):
+                app.dependency_overrides[dependency] = get_db
+        client = AppClient(app)
+
+    try:
+        results = asyncio.run(run(client, dataset, ops, args.concurrency, args.warmup))
+    finally:
+        client.close()
+
+    report = {
+        "meta": {"commit": git_commit(), "created_at": datetime.now(timezone.utc).isoformat(),
+                 "target": client.name, "database": engine.dialect.name,
+                 "database_async": settings.database_async and not args.database and not args.url,
+                 "users": len(dataset.user_ids), "posts": len(dataset.post_ids), "votes": args.votes,
+                 "requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency,
+                 "seed": args.seed, "mix": args.mix},
+        **results,
+    }
+    with open(args.output, "wb") as file:
+        file.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+    print(f'{"endpoint":<18} {"requests":>8} {"errors":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for endpoint, stats in [*report["endpoints"].items(), ("total", report["total"])]:
+        print(f'{endpoint:<18} {stats["requests"]:>8} {stats["errors"]:>6} {stats["throughput_rps"]:>9.1f} '
+              f'{stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f}')
+    print(f'written to {args.output}')
+
+
+if __name__ == "__main__":
+    main()
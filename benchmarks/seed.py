@@ -0,0 +1,88 @@
+# Seeds a database with benchmark users, posts and votes (see loadtest.py)
+# The rows are written directly with batched inserts, not through the endpoints,
+# and all the users share one password, hashed once (bcrypt per user would take ages)
+# The data only depends on the seed: the same seed gives the same users, posts and votes,
+# and seeding again with a seed already in the database reuses its rows instead of adding new ones
+# (only at the same scale: the users and posts of the seed must be the ones asked for, or the results of two
+# runs could not be compared; the votes are not checked, every run of the load test casts and removes some)
+from dataclasses import dataclass, field
+from random import Random
+from typing import List
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from app import models, utils
+from app.reconcile import reconcile_vote_counts
+
+PASSWORD = "benchmark"
+BATCH_SIZE = 1000
+
+
+class ScaleMismatch(Exception):
+    pass
+
+
+@dataclass
+class Dataset:
+    user_ids: List[int] = field(default_factory=list)
+    emails: List[str] = field(default_factory=list)
+    post_ids: List[int] = field(default_factory=list)
+
+
+def email_prefix(seed: int):
+    return f'bench{seed}-'
+
+
+def _batches(rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        yield rows[start:start + BATCH_SIZE]
+
+
+def _insert(db: Session, table, rows):
+    for batch in _batches(rows):
+        db.execute(insert(table), batch)
+
+
+# the users of the seed already in the database, and their posts
+def load(db: Session, seed: int) -> Dataset:
+    users = db.execute(select(models.User.id, models.User.email).where(
+        models.User.email.like(email_prefix(seed) + '%')).order_by(models.User.id)).all()
+    dataset = Dataset([user.id for user in users], [user.email for user in users])
+    if dataset.user_ids:
+        dataset.post_ids = list(db.execute(select(models.Post.id).where(
+            models.Post.owner_id.in_(dataset.user_ids)).order_by(models.Post.id)).scalars())
+    return dataset
+
+
+def seed(db: Session, users: int, posts: int, votes: int, seed: int = 0) -> Dataset:
+    dataset = load(db, seed)
+    if dataset.user_ids:
+        if (len(dataset.user_ids), len(dataset.post_ids)) != (users, posts):
+            raise ScaleMismatch(
+                f'The seed {seed} is already in the database with {len(dataset.user_ids)} users and '
+                f'{len(dataset.post_ids)} posts, not {users} and {posts}: use another seed (or another database)')
+        return dataset
+
+    rng = Random(seed)
+    password = utils.hash_function(PASSWORD)
+    prefix = email_prefix(seed)
+    _insert(db, models.User.__table__, [
+        {"email": f'{prefix}{i}@example.com', "password": password, "name": f'Benchmark user {i}'}
+        for i in range(users)])
+    user_ids = list(db.execute(select(models.User.id).where(
+        models.User.email.like(prefix + '%')).order_by(models.User.id)).scalars())
+
+    _insert(db, models.Post.__table__, [
+        {"title": f'Benchmark post {i}', "content": f'Post {i} of the benchmark, seed {seed}',
+         "rating": rng.randint(1, 5), "owner_id": rng.choice(user_ids)}
+        for i in range(posts)])
+    post_ids = list(db.execute(select(models.Post.id).where(
+        models.Post.owner_id.in_(user_ids)).order_by(models.Post.id)).scalars())
+
+    # every (user, post) pair can only vote once
+    pairs = rng.sample(range(len(user_ids) * len(post_ids)), min(votes, len(user_ids) * len(post_ids)))
+    _insert(db, models.Vote.__table__, [
+        {"user_id": user_ids[pair // len(post_ids)], "post_id": post_ids[pair % len(post_ids)]}
+        for pair in pairs])
+    db.commit()
+    reconcile_vote_counts(db)
+    return load(db, seed)
@@ -0,0 +1,89 @@
+import os
+import uuid
+from alembic import command
+from alembic.config import Config
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.main import app
+from app import models, ratelimit
+from app.routers.auth import create_access_token
+import pytest
+
+
+# The tables of the test database are created once, by the migrations (like in production)
+def alembic_config():
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "..", "alembic"))
+    return config
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_db():
+    command.upgrade(alembic_config(), "head")
+
+
+# All the tests come from the same client, the rate limits are only switched on by the tests of ratelimit.py
+@pytest.fixture(scope="session", autouse=True)
+def no_rate_limits():
+    ratelimit.rate_limiter.limits = {}
+
+
+@pytest.fixture(scope="function")
+def client():
+    yield TestClient(app)
+
+
+# Every call creates a brand new user, with a random email so that the tests can be run again
+# against the same database
+@pytest.fixture
+def make_user(client):
+    def _make_user():
+        user_data = {"email": f"{uuid.uuid4().hex}@email.com",
+                     "password": "pass123", "name": "Post Test"}
+        res = client.post("/users", json=user_data)
+        assert res.status_code == 201
+
+        new_user = res.json()
+        new_user['password'] = user_data['password']
+        return new_user
+    return _make_user
+
+
+@pytest.fixture
+def post_user(make_user):
+    return make_user()
+
+
+# Headers with the bearer token of post_user
+@pytest.fixture
+def auth_headers(post_user):
+    token = create_access_token({"user_id": post_user['id']})
+    return {"Authorization": f"Bearer {token}"}
+
+
+# A few posts owned by post_user, all with the same random keyword in their title
+# so that a test can find only its own posts
+@pytest.fixture
+def test_posts(client, auth_headers):
+    keyword = uuid.uuid4().hex
+    posts = []
+    for i in range(7):
+        res = client.post("/posts", json={"title": f"{keyword} post {i}", "content": f"content {i}"},
+                          headers=auth_headers)
+        assert res.status_code == 201
+        posts.append(res.json())
+    return keyword, posts
+
+
+# A session on an in-memory SQLite database with all the tables, and one user in it
+# for the tests which do not need Postgres
+@pytest.fixture
+def sqlite_db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(models.User(email="sqlite@email.com", password="x", name="SQLite"))
+    db.commit()
+    yield db
+    db.close()
@@ -0,0 +1,49 @@
+from app import models
+from app.cache import TTLCache
+from app.routers import auth
+
+
+def test_ttl_cache_lru_and_expiry():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "one")
+    cache.set(2, "two")
+    assert cache.get(1) == "one"     # 1 is now the most recently used
+    cache.set(3, "three")            # so 2 is thrown away
+    assert cache.get(2) is None
+    assert cache.get(3) == "three"
+
+    cache.set(4, "four", ttl=0)      # expired straight away
+    assert cache.get(4) is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_current_user_is_cached(client, post_user, auth_headers):
+    auth.invalidate_user(post_user['id'])
+    # voting a post which does not exist: the user lookup (if any) + the post lookup
+    first = client.post("/votes", json={"post_id": 0, "dir": 1}, headers=auth_headers)
+    second = client.post("/votes", json={"post_id": 0, "dir": 1}, headers=auth_headers)
+    assert first.status_code == second.status_code == 404
+    assert int(first.headers["X-Query-Count"]) == int(second.headers["X-Query-Count"]) + 1
+
+
+def test_changed_user_is_invalidated(sqlite_db):
+    user = sqlite_db.query(models.User).first()
+    auth.user_cache.set(user.id, "cached")
+    user.name = "Renamed"
+    sqlite_db.commit()
+    assert auth.user_cache.get(user.id) is None
+
+
+def test_verified_token_is_cached_until_revoked(client, auth_headers):
+    token = auth_headers["Authorization"].split(" ")[1]
+    digest = auth.token_digest(token)
+    auth.token_cache.invalidate(digest)
+
+    res = client.post("/votes", json={"post_id": 0, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 404
+    assert auth.token_cache.get(digest) is not None
+
+    assert client.post("/logout", headers=auth_headers).status_code == 204
+    assert auth.token_cache.get(digest) is None
+    res = client.post("/votes", json={"post_id": 0, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 401
@@ -0,0 +1,94 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from app import compression
+from app.compression import CompressionMiddleware, choose_encoding
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert choose_encoding("gzip, deflate, br") == "gzip"
+    assert choose_encoding("deflate") is None
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("*") == "gzip"
+    assert choose_encoding("") is None
+    monkeypatch.setattr(compression, "brotli", object())
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("gzip;q=1, br;q=0.5") == "gzip"
+
+
+def test_large_list_is_compressed(client, test_posts):
+    res = client.get("/posts", params={"limit": 50}, headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert len(res.json()) >= 7
+
+    # too small to be worth it, or not asked for
+    res = client.get("/posts", params={"limit": 1}, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in res.headers
+    res = client.get("/posts", params={"limit": 50}, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in res.headers
+
+
+# the ETag of a compressed post (made weak) can be sent back to edit it
+def test_compressed_etag_for_if_match(client, auth_headers):
+    res = client.post("/posts", json={"title": "long", "content": "x" * 1500}, headers=auth_headers)
+    post_id = res.json()["id"]
+    res = client.get(f"/posts/{post_id}", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    etag = res.headers["ETag"]
+    assert etag == 'W/"1.0"'
+
+    edit = {"title": "edited", "content": "y" * 1500}
+    res = client.put(f"/posts/{post_id}", json=edit, headers={**auth_headers, "If-Match": etag})
+    assert res.status_code == 200 and res.json()["version"] == 2
+    # the old version does not match any more, weak or not
+    res = client.put(f"/posts/{post_id}", json=edit, headers={**auth_headers, "If-Match": etag})
+    assert res.status_code == 412
+
+
+def make_app():
+    app = Starlette()
+
+    @app.route("/post")
+    async def post(request):
+        return Response(b'{"title": "' + b"a" * 2000 + b'"}', media_type="application/json",
+                        headers={"ETag": '"1.0"'})
+
+    @app.route("/image")
+    async def image(request):
+        return Response(b"\x89PNG" * 1000, media_type="image/png")
+
+    @app.route("/stream")
+    async def stream(request):
+        async def rows():
+            for i in range(100):
+                yield b'{"id": %d}\n' % i
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    return TestClient(CompressionMiddleware(app, minimum_size=500))
+
+
+def test_compression_middleware():
+    client = make_app()
+    res = client.get("/post", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert int(res.headers["Content-Length"]) < 100
+    # (the test client decompresses the body)
+    assert res.content.startswith(b'{"title": "aaa')
+    # the compressed bytes are not the ones of the strong tag
+    assert res.headers["ETag"] == 'W/"1.0"'
+
+    assert "Content-Encoding" not in client.get("/image", headers={"Accept-Encoding": "gzip"}).headers
+
+    res = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert res.text.splitlines()[-1] == '{"id": 99}'
+
+
+def test_brotli():
+    pytest.importorskip("brotli")
+    res = make_app().get("/post", headers={"Accept-Encoding": "gzip, br"})
+    assert res.headers["Content-Encoding"] == "br"
+    assert res.content.startswith(b'{"title": "aaa')
@@ -0,0 +1,83 @@
+import asyncio
+import csv
+import io
+import json
+import pytest
+from app import database
+from app.config import settings
+from app.main import app
+from app.routers import export
+
+
+@pytest.fixture
+def admin_headers(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    # small batches, so that the export needs several of them
+    monkeypatch.setattr(settings, "export_batch_size", 2)
+    return {"X-Admin-Token": "secret"}
+
+
+def test_export_posts_ndjson(client, admin_headers, test_posts):
+    keyword, posts = test_posts
+    res = client.get("/export/posts", headers=admin_headers)
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    exported = [json.loads(line) for line in res.text.splitlines()]
+    ids = [post["id"] for post in exported]
+    assert ids == sorted(ids)
+    assert {post["id"] for post in posts} <= set(ids)
+    assert set(exported[0]) == {"id", "title", "content", "published", "rating", "created_at",
+                                "owner_id", "vote_count"}
+
+
+def test_export_users_csv(client, admin_headers, post_user):
+    res = client.get("/export/users", params={"format": "csv"}, headers=admin_headers)
+    assert res.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(res.text)))
+    assert post_user["email"] in {row["email"] for row in rows}
+    assert "password" not in rows[0]
+
+
+def test_export_needs_admin(client):
+    assert client.get("/export/users").status_code == 403
+
+
+# the middlewares pass the body on as it comes: while the client is slow to take a batch of rows,
+# the next batches are not read from the database (they would pile up in memory)
+def test_export_is_not_buffered(admin_headers, test_posts, monkeypatch):
+    read_batches = []
+
+    async def counting_stream_db(db, statement, batch_size):
+        async for rows in database.stream_db(db, statement, batch_size):
+            read_batches.append(len(rows))
+            yield rows
+
+    monkeypatch.setattr(export, "stream_db", counting_stream_db)
+    read_when_sent = []
+
+    done = asyncio.Event()
+    requested = []
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def slow_send(message):
+        if message["type"] == "http.response.body" and message.get("more_body"):
+            read_when_sent.append(len(read_batches))
+            await asyncio.sleep(0.01)
+        elif message["type"] == "http.response.body":
+            done.set()
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/export/posts", "raw_path": b"/export/posts", "query_string": b"",
+             "root_path": "", "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+             "headers": [(b"x-admin-token", b"secret")]}
+    # in the loop of the TestClient, the one of the asyncpg connections in the pool
+    asyncio.get_event_loop().run_until_complete(app(scope, receive, slow_send))
+    assert len(read_batches) > 3
+    # (the header row of the CSV / the first batch is sent once it is read, then one batch at a time)
+    assert read_when_sent[:3] == [1, 2, 3]
@@ -0,0 +1,104 @@
+from sqlalchemy import select
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.reconcile import reconcile_follower_counts
+from app.routers.auth import create_access_token
+
+
+def headers_of(user):
+    return {"Authorization": f"Bearer {create_access_token({'user_id': user['id']})}"}
+
+
+def new_post(client, headers, title):
+    res = client.post("/posts", json={"title": title, "content": title}, headers=headers)
+    assert res.status_code == 201
+    return res.json()["id"]
+
+
+def feed_ids(client, headers, **params):
+    res = client.get("/feed", params=params, headers=headers)
+    assert res.status_code == 200
+    return [item["Post"]["id"] for item in res.json()]
+
+
+def test_follow(client, make_user):
+    reader, author = make_user(), make_user()
+    assert client.post(f"/users/{author['id']}/follow", headers=headers_of(reader)).status_code == 201
+    assert client.post(f"/users/{author['id']}/follow", headers=headers_of(reader)).status_code == 409
+    assert client.post(f"/users/{reader['id']}/follow", headers=headers_of(reader)).status_code == 400
+    assert client.post("/users/0/follow", headers=headers_of(reader)).status_code == 404
+    with SessionLocal() as db:
+        assert db.get(models.User, author["id"]).follower_count == 1
+    assert client.delete(f"/users/{author['id']}/follow", headers=headers_of(reader)).status_code == 204
+    assert client.delete(f"/users/{author['id']}/follow", headers=headers_of(reader)).status_code == 404
+    with SessionLocal() as db:
+        assert db.get(models.User, author["id"]).follower_count == 0
+
+
+def test_fan_out_on_write(client, make_user):
+    reader, author, stranger = make_user(), make_user(), make_user()
+    old_post = new_post(client, headers_of(author), "before the follow")
+    client.post(f"/users/{author['id']}/follow", headers=headers_of(reader))
+    own_post = new_post(client, headers_of(reader), "my own post")
+    posts = [new_post(client, headers_of(author), f"post {i}") for i in range(3)]
+    new_post(client, headers_of(stranger), "not followed")
+
+    # newest first, with the backfilled post of the author and the own post of the reader
+    assert feed_ids(client, headers_of(reader)) == posts[::-1] + [own_post, old_post]
+    res = client.get("/feed", params={"limit": 2}, headers=headers_of(reader))
+    assert [item["Post"]["id"] for item in res.json()] == [posts[2], posts[1]]
+    assert feed_ids(client, headers_of(reader), limit=2, cursor=res.headers["X-Next-Cursor"]) == [posts[0], own_post]
+
+    # a deleted post leaves the feed, unfollowing removes the posts of the author
+    assert client.delete(f"/posts/{posts[2]}", headers=headers_of(author)).status_code == 204
+    assert posts[2] not in feed_ids(client, headers_of(reader))
+    client.delete(f"/users/{author['id']}/follow", headers=headers_of(reader))
+    assert feed_ids(client, headers_of(reader)) == [own_post]
+
+
+def test_feed_cost_does_not_depend_on_follows(client, make_user):
+    reader = make_user()
+    authors = [make_user() for i in range(6)]
+    query_counts = []
+    for author in authors:
+        client.post(f"/users/{author['id']}/follow", headers=headers_of(reader))
+        new_post(client, headers_of(author), "post")
+        res = client.get("/feed", headers=headers_of(reader))
+        query_counts.append(res.headers["X-Query-Count"])
+    assert len(res.json()) == 6
+    # the timeline page and the (empty) pulled accounts
+    assert set(query_counts) == {"2"}
+
+
+def test_hybrid_pull(client, make_user, monkeypatch):
+    reader, *celebrities = make_user(), make_user(), make_user()
+    followed_post = new_post(client, headers_of(celebrities[0]), "before")
+    monkeypatch.setattr(settings, "feed_pull_followers", 1)
+    for celebrity in celebrities:
+        client.post(f"/users/{celebrity['id']}/follow", headers=headers_of(reader))
+    own_post = new_post(client, headers_of(reader), "mine")
+    posts = [new_post(client, headers_of(celebrities[i % 2]), f"post {i}") for i in range(4)]
+
+    # not in the timeline of the reader, pulled when the feed is read
+    with SessionLocal() as db:
+        assert set(db.execute(select(models.Timeline.post_id).where(
+            models.Timeline.user_id == reader["id"])).scalars()) == {own_post}
+    assert feed_ids(client, headers_of(reader)) == posts[::-1] + [own_post, followed_post]
+    res = client.get("/feed", params={"limit": 3}, headers=headers_of(reader))
+    assert [item["Post"]["id"] for item in res.json()] == posts[:0:-1]
+    assert feed_ids(client, headers_of(reader), cursor=res.headers["X-Next-Cursor"]) == [
+        posts[0], own_post, followed_post]
+
+
+def test_reconcile_follower_counts(sqlite_db):
+    users = [models.User(email=f"{i}@example.com", password="x", name="x") for i in range(2)]
+    sqlite_db.add_all(users)
+    sqlite_db.commit()
+    # a follow written behind the back of feed.follow
+    sqlite_db.add(models.Follow(follower_id=users[0].id, followed_id=users[1].id))
+    sqlite_db.commit()
+    assert reconcile_follower_counts(sqlite_db) == 1
+    sqlite_db.refresh(users[1])
+    assert users[1].follower_count == 1
+    assert reconcile_follower_counts(sqlite_db) == 0
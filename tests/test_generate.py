@@ -0,0 +1,52 @@
+import random
+from sqlalchemy import create_engine, inspect, select, text
+from app import models
+from app.database import engine, SessionLocal
+from app.reconcile import reconcile_vote_counts
+from benchmarks import generate
+
+
+def test_vote_counts_follow_zipf():
+    counts = generate.vote_counts(posts=1000, users=50, votes=10000, s=1.1)
+    assert sum(counts) == 10000
+    assert max(counts) == 50                    # no post gets more votes than there are users
+    assert sorted(counts)[len(counts) // 2] < 10    # but most posts get only a few
+
+
+def _rows(url):
+    sqlite = create_engine(url)
+    models.Base.metadata.create_all(bind=sqlite)
+    generate.generate(sqlite, users=20, posts=50, votes=200, seed=3, batch_size=7, log=lambda message: None)
+    with sqlite.connect() as conn:
+        return (conn.execute(select(models.User.id, models.User.email)).all(),
+                conn.execute(select(models.Post.id, models.Post.title, models.Post.owner_id,
+                                    models.Post.vote_count)).all(),
+                conn.execute(select(models.Vote.user_id, models.Vote.post_id)).all())
+
+
+# the same seed gives the same data (the timestamps follow the current time)
+def test_batched_inserts_are_deterministic():
+    users, posts, votes = _rows("sqlite://")
+    assert (users, posts, votes) == _rows("sqlite://")
+    assert len(users) == 20 and len(posts) == 50 and len(votes) == 200
+    assert sum(post.vote_count for post in posts) == 200
+
+
+def test_copy_into_postgres():
+    seed = random.randrange(10 ** 9)
+    generate.generate(engine, users=30, posts=100, votes=500, seed=seed, batch_size=40, log=lambda message: None)
+    with SessionLocal() as db:
+        # vote_count was written with the posts, it matches the votes
+        assert reconcile_vote_counts(db) == 0
+        # the sequences are after the generated ids
+        post = models.Post(title="after", content="the generated posts",
+                           owner_id=db.execute(select(models.User.id).limit(1)).scalar())
+        db.add(post)
+        db.commit()
+        assert post.id == db.execute(select(models.Post.id).order_by(models.Post.id.desc())).scalar()
+        indexes = set(db.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename IN ('posts', 'votes')")).scalars())
+    # the indexes and foreign keys dropped during the load are back
+    assert {"ix_posts_owner_id_id", "ix_posts_created_at_id", "ix_posts_search", "ix_votes_post_id"} <= indexes
+    inspector = inspect(engine)
+    assert len(inspector.get_foreign_keys("posts")) == 1 and len(inspector.get_foreign_keys("votes")) == 2
@@ -0,0 +1,73 @@
+import pstats
+from app.config import settings
+from app.metrics import Histogram
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"0.1": 2, "1.0": 3, "+Inf": 4}
+    assert snapshot["count"] == 4
+
+
+def test_internal_cache_stats_need_admin(client, monkeypatch):
+    assert client.get("/internal/cache").status_code == 403
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    assert client.get("/internal/cache", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    res = client.get("/internal/cache", headers={"X-Admin-Token": "secret"})
+    assert res.status_code == 200
+    assert "hit_ratio" in res.json()["responses"]
+
+
+def test_internal_pool_stats(client, monkeypatch, test_posts):
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    res = client.get("/internal/pool", headers={"X-Admin-Token": "secret"})
+    assert res.status_code == 200
+    pool = res.json()["async" if settings.database_async else "sync"]
+    assert pool["size"] == settings.db_pool_size
+    assert pool["wait_time_seconds"]["count"] > 0
+    assert pool["wait_time_seconds"]["buckets"]["+Inf"] == pool["wait_time_seconds"]["count"]
+
+
+def test_slow_queries_with_plans(client, monkeypatch, test_posts):
+    keyword, posts = test_posts
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    # every query is slow, and every slow SELECT gets its plan
+    monkeypatch.setattr(settings, "slow_query_threshold_ms", 0)
+    monkeypatch.setattr(settings, "slow_query_explain_sample_rate", 1.0)
+    client.get(f"/posts/{posts[0]['id']}")
+    monkeypatch.setattr(settings, "slow_query_threshold_ms", 1e9)
+
+    res = client.get("/internal/slow-queries", headers={"X-Admin-Token": "secret"})
+    assert res.status_code == 200
+    latest = res.json()[0]
+    assert latest["route"] == "GET /posts/{id}"
+    assert latest["statement"].lstrip().startswith("SELECT")
+    assert "Buffers" in latest["plan"] or "actual time" in latest["plan"]
+    # the request still worked after the EXPLAIN
+    assert client.get(f"/posts/{posts[1]['id']}").status_code == 200
+
+
+def test_profile_on_demand(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "profile_max_files", 2)
+    admin = {"X-Admin-Token": "secret"}
+
+    # not asked for (or not allowed to ask): no profile
+    assert "X-Profile-Id" not in client.get("/").headers
+    assert "X-Profile-Id" not in client.get("/", headers={"X-Profile": "1"}).headers
+
+    names = [client.get("/posts", headers={"X-Profile": "1", **admin}).headers["X-Profile-Id"]
+             for i in range(3)]
+    assert all("GET-posts" in name for name in names)
+    # only the newest ones are kept
+    assert client.get("/internal/profiles", headers=admin).json() == sorted(names, reverse=True)[:2]
+
+    res = client.get(f"/internal/profiles/{names[-1]}", headers=admin)
+    assert res.status_code == 200
+    profile_file = tmp_path / "downloaded.pstats"
+    profile_file.write_bytes(res.content)
+    assert pstats.Stats(str(profile_file)).total_calls > 0
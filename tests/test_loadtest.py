@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from app.database import SessionLocal, async_engine
+from app.main import app
+from benchmarks import loadtest, seed
+from benchmarks.compare import compare
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([7], 95) == 7
+
+
+def test_seed_is_reused():
+    with SessionLocal() as db:
+        first = seed.seed(db, users=3, posts=10, votes=10, seed=424242)
+        again = seed.seed(db, users=3, posts=10, votes=10, seed=424242)
+    assert len(first.user_ids) == 3 and len(first.post_ids) == 10
+    assert again == first
+    # not at another scale
+    with SessionLocal() as db, pytest.raises(seed.ScaleMismatch):
+        seed.seed(db, users=3, posts=20, votes=10, seed=424242)
+
+
+def test_in_process_run():
+    with SessionLocal() as db:
+        dataset = seed.seed(db, users=3, posts=10, votes=10, seed=424242)
+    mix = {"GET /posts": 1, "GET /posts/{id}": 1, "POST /votes": 1, "GET /users/{id}": 1}
+    ops = loadtest.script(dataset, mix, 40, seed=1)
+    assert ops == loadtest.script(dataset, mix, 40, seed=1)
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(loadtest.run(loadtest.AppClient(app), dataset, ops, concurrency=4, warmup=4))
+    finally:
+        # the asyncpg connections opened in this loop can not be used by the other tests
+        if async_engine is not None:
+            loop.run_until_complete(async_engine.dispose())
+        loop.close()
+    assert results["total"]["requests"] == 36
+    assert results["total"]["errors"] == 0
+    assert set(results["endpoints"]) <= set(mix)
+
+    # the same run compared with itself is no regression, a run twice as slow is one
+    report = {"meta": {}, **results}
+    assert compare(report, report, 10)[1] == []
+    slower = {**report, "total": {**report["total"], "p95_ms": report["total"]["p95_ms"] * 2}}
+    assert compare(report, slower, 10)[1] == ["total"]
+
+
+# a request which gets no answer is counted as failed, next to the status codes
+def test_failed_requests_are_reported():
+    class FlakyClient:
+        async def request(self, method, path, headers, body):
+            if method == "POST":
+                raise ConnectionError("connection reset")
+            return 200
+
+    dataset = seed.Dataset(user_ids=[1], emails=["a@b.c"], post_ids=[1])
+    ops = loadtest.script(dataset, {"GET /posts": 1, "POST /votes": 1}, 20, seed=1)
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(loadtest.run(FlakyClient(), dataset, ops, concurrency=2))
+    finally:
+        loop.close()
+    votes = sum(op.endpoint == "POST /votes" for op in ops)
+    assert results["endpoints"]["POST /votes"]["status_codes"] == {"failed": votes}
+    assert results["total"]["status_codes"] == {"200": 20 - votes, "failed": votes}
+    assert results["total"]["errors"] == votes
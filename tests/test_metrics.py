@@ -0,0 +1,20 @@
+def test_metrics_per_route(client, test_posts):
+    keyword, posts = test_posts
+    client.get(f"/posts/{posts[0]['id']}")
+    client.get("/posts/0")
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    text = res.text
+    # by path template, not by post id
+    assert 'http_requests_total{method="GET",route="/posts/{id}",status="200"}' in text
+    assert 'http_requests_total{method="GET",route="/posts/{id}",status="404"}' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/posts/{id}",le="+Inf"}' in text
+    assert 'http_request_sql_queries_count{method="POST",route="/posts"}' in text
+    assert "http_requests_in_progress 1" in text     # the /metrics request itself
+    assert 'cache_hits_total{cache="tokens"}' in text
+
+
+def test_unmatched_routes_share_one_series(client):
+    client.get("/no/such/path")
+    assert 'route="unmatched",status="404"' in client.get("/metrics").text
@@ -0,0 +1,43 @@
+import asyncio
+import time
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from app import models, utils
+from app.config import settings
+from app.database import SessionLocal
+
+
+def test_password_pool_rejects_when_full():
+    pool = utils.PasswordPool("thread", workers=1, queue_size=0)
+
+    async def two_jobs():
+        return await asyncio.gather(pool.run(time.sleep, 0.2), pool.run(time.sleep, 0.2),
+                                    return_exceptions=True)
+
+    # a loop of its own, the loop of the TestClient (and its asyncpg connections) is left alone
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(two_jobs())
+    finally:
+        loop.close()
+    assert results[0] is None
+    assert isinstance(results[1], HTTPException) and results[1].status_code == 429
+    assert pool.pending == 0
+
+
+def test_login_rehashes_old_cost(client, post_user):
+    # store a hash made with a cheaper cost than the one in the settings
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=4).hash(post_user['password'])
+    with SessionLocal() as db:
+        db.query(models.User).filter(models.User.id == post_user['id']).update(
+            {models.User.password: old_hash}, synchronize_session=False)
+        db.commit()
+
+    res = client.post("/login", json={"email": post_user['email'], "password": post_user['password']})
+    assert res.status_code == 200
+
+    with SessionLocal() as db:
+        new_hash = db.query(models.User.password).filter(models.User.id == post_user['id']).scalar()
+    assert new_hash != old_hash
+    assert new_hash.startswith(f"$2b${settings.bcrypt_rounds:02d}$")
+    assert utils.verify_password(post_user['password'], new_hash)
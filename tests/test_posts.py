@@ -0,0 +1,162 @@
+import asyncio
+import uuid
+from datetime import datetime
+from app import models, utils
+from app.response_cache import response_cache
+from app.routers import post
+from app.routers.auth import create_access_token
+
+
+def test_get_posts_cursor_pagination(client, test_posts):
+    keyword, posts = test_posts
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 3, "search_keyword": keyword}
+        if cursor:
+            params["cursor"] = cursor
+        res = client.get("/posts", params=params)
+        assert res.status_code == 200
+        seen += [post["Post"]["id"] for post in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    # newest posts first, every post exactly once
+    assert seen == [post["id"] for post in reversed(posts)]
+
+
+def test_get_posts_legacy_skip(client, test_posts):
+    keyword, posts = test_posts
+    res = client.get("/posts", params={"limit": 3, "skip": 6, "search_keyword": keyword})
+    assert res.status_code == 200
+    assert len(res.json()) == 1
+    assert "X-Next-Cursor" not in res.headers
+
+
+def test_get_posts_invalid_cursor(client):
+    res = client.get("/posts", params={"cursor": "not-a-cursor"})
+    assert res.status_code == 400
+
+
+def test_cursor_round_trip(test_posts):
+    keyword, posts = test_posts
+    created_at = datetime.fromisoformat(posts[0]["created_at"])
+    assert utils.decode_cursor(utils.encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+def test_search_posts(client, auth_headers):
+    res = client.post("/posts", json={"title": "Sourdough zymurgy basics", "content": "flour and water"},
+                      headers=auth_headers)
+    title_match = res.json()
+    res = client.post("/posts", json={"title": "Weekend notes", "content": "some zymurgy in the content"},
+                      headers=auth_headers)
+    content_match = res.json()
+
+    res = client.get("/posts/search", params={"q": "zymurgy", "limit": 50})
+    assert res.status_code == 200
+    found = [result["Post"]["id"] for result in res.json()]
+    assert title_match["id"] in found and content_match["id"] in found
+    assert all(result["rank"] > 0 for result in res.json())
+
+
+def test_get_posts_no_n_plus_one(client, make_user):
+    keyword = uuid.uuid4().hex
+    # every post with a different owner, so that every owner would need its own lazy load
+    for i in range(4):
+        owner = make_user()
+        headers = {"Authorization": f"Bearer {create_access_token({'user_id': owner['id']})}"}
+        res = client.post("/posts", json={"title": f"{keyword} {i}", "content": "n+1"}, headers=headers)
+        assert res.status_code == 201
+
+    one_post = client.get("/posts", params={"limit": 1, "search_keyword": keyword})
+    four_posts = client.get("/posts", params={"limit": 4, "search_keyword": keyword})
+    assert len(four_posts.json()) == 4
+    assert len({post["Post"]["owner"]["id"] for post in four_posts.json()}) == 4
+    # the owners come with the posts: the number of queries does not grow with the page
+    assert four_posts.headers["X-Query-Count"] == one_post.headers["X-Query-Count"] == "1"
+
+
+def test_get_post_single_query(client, test_posts):
+    keyword, posts = test_posts
+    res = client.get(f"/posts/{posts[0]['id']}")
+    assert res.status_code == 200
+    assert res.headers["X-Query-Count"] == "1"
+
+
+def test_conditional_get(client, test_posts):
+    keyword, posts = test_posts
+    res = client.get(f"/posts/{posts[1]['id']}")
+    etag = res.headers["ETag"]
+    assert etag == '"1.0"'
+    # from the cache, then from the database
+    for i in range(2):
+        res = client.get(f"/posts/{posts[1]['id']}", headers={"If-None-Match": etag})
+        assert res.status_code == 304 and res.content == b"" and res.headers["ETag"] == etag
+        asyncio.get_event_loop().run_until_complete(response_cache.post_changed(posts[1]['id']))
+    res = client.get(f"/posts/{posts[1]['id']}", headers={"If-None-Match": '"7.0"'})
+    assert res.status_code == 200
+
+
+def test_update_and_delete_with_if_match(client, auth_headers, test_posts, make_user):
+    keyword, posts = test_posts
+    post_id = posts[2]["id"]
+    etag = client.get(f"/posts/{post_id}").headers["ETag"]
+    edit = {"title": "edited", "content": "edited"}
+
+    # one statement for the edit (the current user is already in the cache)
+    res = client.put(f"/posts/{post_id}", json=edit, headers={**auth_headers, "If-Match": etag})
+    assert res.status_code == 200 and res.headers["X-Query-Count"] == "1"
+    assert res.json()["version"] == 2 and res.json()["owner"]["id"] == posts[2]["owner_id"]
+    new_etag = res.headers["ETag"]
+    assert client.get(f"/posts/{post_id}").headers["ETag"] == new_etag
+
+    # the edit was made from the old version: someone else changed the post meanwhile
+    res = client.put(f"/posts/{post_id}", json=edit, headers={**auth_headers, "If-Match": etag})
+    assert res.status_code == 412
+    res = client.delete(f"/posts/{post_id}", headers={**auth_headers, "If-Match": etag})
+    assert res.status_code == 412
+
+    # a vote changes the ETag (the response has the votes), but does not conflict with an edit
+    client.post("/votes", json={"post_id": post_id, "dir": 1}, headers=auth_headers)
+    assert client.get(f"/posts/{post_id}").headers["ETag"] == '"2.1"'
+    res = client.put(f"/posts/{post_id}", json=edit, headers={**auth_headers, "If-Match": new_etag})
+    assert res.status_code == 200
+
+    other_user = make_user()
+    other_headers = {"Authorization": f"Bearer {create_access_token({'user_id': other_user['id']})}"}
+    assert client.put(f"/posts/{post_id}", json=edit, headers=other_headers).status_code == 403
+    assert client.delete(f"/posts/{post_id}", headers=other_headers).status_code == 403
+
+    res = client.delete(f"/posts/{post_id}", headers=auth_headers)
+    assert res.status_code == 204 and res.headers["X-Query-Count"] == "1"
+    assert client.delete(f"/posts/{post_id}", headers=auth_headers).status_code == 404
+    assert client.get(f"/posts/{post_id}").status_code == 404
+
+
+def test_sparse_fields(client, test_posts):
+    keyword, posts = test_posts
+    res = client.get("/posts", params={"search_keyword": keyword, "fields": "title,id"})
+    assert res.status_code == 200
+    assert [set(item["Post"]) for item in res.json()] == [{"id", "title"}] * 5
+    assert all("votes" in item for item in res.json())
+    # the owners come from the same query
+    res = client.get("/posts", params={"search_keyword": keyword, "fields": "owner"})
+    assert res.json()[0]["Post"]["owner"]["id"] == posts[0]["owner_id"]
+    assert res.headers["X-Query-Count"] == "1"
+    assert client.get("/posts", params={"fields": "title,password"}).status_code == 400
+
+    # another representation of the post, with its own ETag
+    res = client.get(f"/posts/{posts[0]['id']}", params={"fields": "title"})
+    assert res.json() == {"Post": {"title": posts[0]["title"]}, "votes": 0}
+    assert res.headers["ETag"] == '"1.0.title"'
+    res = client.get(f"/posts/{posts[0]['id']}", params={"fields": "title"}, headers={"If-None-Match": '"1.0"'})
+    assert res.status_code == 200
+
+
+def test_sparse_fields_query(sqlite_db):
+    sql = str(sqlite_db.query(models.Post).options(*post.post_loading(("title",))))
+    assert "posts.title" in sql and "posts.content" not in sql and "users" not in sql
+    sql = str(sqlite_db.query(models.Post).options(*post.post_loading(("title", "owner"))))
+    assert "posts.content" not in sql and "users" in sql
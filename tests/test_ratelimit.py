@@ -0,0 +1,125 @@
+import asyncio
+import time
+import pytest
+from app import ratelimit
+from app.ratelimit import Limit, MemoryBackend, RateLimiter, RedisBackend, parse_limits, take_token
+from app.routers.auth import create_access_token
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_parse_limits():
+    assert parse_limits("POST /login=10/60, *=600/60,") == {"POST /login": Limit(10, 60.0), "*": Limit(600, 60.0)}
+
+
+def test_token_bucket():
+    limit = Limit(3, 30)
+    full_at = now = 1000.0
+    # a burst of the whole bucket, then one more every 10 seconds
+    for i in range(3):
+        full_at, wait = take_token(full_at, now, limit)
+        assert wait == 0
+    assert take_token(full_at, now, limit) == (full_at, pytest.approx(10))
+    assert take_token(full_at, now + 10, limit)[1] == 0
+    # a full bucket does not save up more than its size
+    assert take_token(full_at, now + 1000, limit) == (now + 1010, 0)
+
+
+def test_memory_backend():
+    backend = MemoryBackend(maxsize=100)
+    limit = Limit(2, 60)
+
+    async def scenario():
+        return [await backend.take(key, limit) for key in ("a", "a", "a", "b")]
+
+    first, second, third, other = run(scenario())
+    assert first == second == 0 and other == 0
+    assert third == pytest.approx(30, abs=1)
+
+
+# Local stand-in for a Redis server: runs the token bucket of the Lua script in Python
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def eval(self, script, numkeys, key, requests, seconds):
+        assert script == ratelimit.TOKEN_BUCKET_LUA and numkeys == 1
+        now = time.time()
+        full_at, wait = take_token(float(self.data.get(key, now)), now, Limit(requests, seconds))
+        if wait:
+            return str(wait).encode()
+        self.data[key] = str(full_at).encode()
+        return b"0"
+
+
+def test_redis_backend():
+    redis = FakeRedis()
+    limiter = RateLimiter(RedisBackend(redis), parse_limits("POST /login=1/60"))
+
+    async def scenario():
+        return [await limiter.check("ip:1", "POST /login") for i in range(2)] + [await limiter.check("ip:1", "GET /posts")]
+
+    assert run(scenario()) == [0, pytest.approx(60, abs=1), 0]
+    assert list(redis.data) == ["fastapi:ratelimit:POST /login:ip:1"]
+    assert limiter.stats()["limited"] == {"POST /login": 1}
+
+
+def test_failing_backend_lets_requests_through():
+    class DownBackend:
+        async def take(self, key, limit):
+            raise ConnectionError("redis is down")
+
+    limiter = RateLimiter(DownBackend(), parse_limits("*=1/60"))
+    assert run(limiter.check("ip:1", "GET /posts")) == 0
+    assert limiter.errors == 1
+
+
+@pytest.fixture
+def rate_limits(monkeypatch):
+    def _rate_limits(text):
+        monkeypatch.setattr(ratelimit.rate_limiter, "backend", MemoryBackend(maxsize=100))
+        monkeypatch.setattr(ratelimit.rate_limiter, "limits", parse_limits(text))
+    return _rate_limits
+
+
+def test_login_rate_limited_by_ip(client, rate_limits):
+    rate_limits("POST /login=2/60")
+    creds = {"email": "nobody@example.com", "password": "wrong"}
+    assert [client.post("/login", json=creds).status_code for i in range(2)] == [403, 403]
+    res = client.post("/login", json=creds)
+    assert res.status_code == 429
+    assert 0 < int(res.headers["Retry-After"]) <= 30
+    # the other routes have their own budget
+    assert client.get("/posts").status_code == 200
+
+
+def test_search_rate_limited_by_user(client, rate_limits, make_user):
+    rate_limits("GET /posts?search_keyword=1/60")
+    first, second = ({"Authorization": f"Bearer {create_access_token({'user_id': make_user()['id']})}"}
+                     for i in range(2))
+    assert client.get("/posts?search_keyword=abc", headers=first).status_code == 200
+    assert client.get("/posts?search_keyword=abc", headers=first).status_code == 429
+    assert client.get("/posts?search_keyword=abc", headers=second).status_code == 200
+    # the listing without a search is not limited
+    assert client.get("/posts", headers=first).status_code == 200
+
+
+def test_load_shedding(client, monkeypatch):
+    monkeypatch.setattr(ratelimit.load_shedder, "max_requests", 1)
+    # one request already in progress
+    monkeypatch.setattr(ratelimit.load_shedder, "in_progress", 1)
+    res = client.get("/posts")
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+    # the metrics are still served
+    assert client.get("/metrics").status_code == 200
+
+    monkeypatch.setattr(ratelimit.load_shedder, "in_progress", 0)
+    assert client.get("/posts").status_code == 200
+    assert ratelimit.load_shedder.in_progress == 0
@@ -0,0 +1,94 @@
+import asyncio
+import time
+import pytest
+from app import database
+from app.config import settings
+from app.replicas import ReplicaSet
+from app.routers.auth import create_access_token
+
+
+# A replica set whose replicas are the test database itself (lag 0) or unreachable ones
+@pytest.fixture
+def use_replicas(monkeypatch):
+    replicas = []
+
+    def _use_replicas(*host_ports, sticky_seconds=10):
+        replicas.extend(database.create_replica(host_port) for host_port in host_ports)
+        replica_set = ReplicaSet(replicas, max_lag=5, check_seconds=60, sticky_seconds=sticky_seconds)
+        monkeypatch.setattr(database, "replica_set", replica_set)
+        return replica_set
+
+    yield _use_replicas
+    for replica in replicas:
+        if settings.database_async:
+            # the connections belong to the loop of the test client
+            asyncio.get_event_loop().run_until_complete(replica.engine.dispose())
+        else:
+            replica.engine.dispose()
+
+
+TEST_DATABASE = f'{settings.database_hostname}:{settings.database_port}'
+
+
+def test_reads_go_to_replica(client, use_replicas, test_posts):
+    keyword, posts = test_posts
+    replica_set = use_replicas(TEST_DATABASE)
+    replica, = replica_set.replicas
+
+    res = client.get(f"/posts/{posts[0]['id']}")
+    assert res.status_code == 200
+    assert client.get("/posts").status_code == 200
+    assert replica.reads == 2
+    assert replica.lag == 0 and replica.error is None
+    assert replica_set.fallback_reads == 0
+
+
+def test_read_your_writes(client, use_replicas, auth_headers):
+    replica_set = use_replicas(TEST_DATABASE)
+    replica, = replica_set.replicas
+
+    res = client.post("/posts", json={"title": "sticky", "content": "sticky"}, headers=auth_headers)
+    assert res.status_code == 201
+    # the writer reads from the primary, the other clients still read from the replica
+    assert client.get(f"/posts/{res.json()['id']}", headers=auth_headers).status_code == 200
+    assert replica_set.sticky_reads == 1 and replica.reads == 0
+    other = {"Authorization": f"Bearer {create_access_token({'user_id': 0})}"}
+    client.get("/posts", headers=other)
+    assert replica.reads == 1
+
+
+def test_stickiness_expires(client, use_replicas, auth_headers):
+    replica_set = use_replicas(TEST_DATABASE, sticky_seconds=0.1)
+    replica, = replica_set.replicas
+
+    assert client.post("/posts", json={"title": "sticky", "content": "sticky"},
+                       headers=auth_headers).status_code == 201
+    time.sleep(0.2)
+    client.get("/posts", headers=auth_headers)
+    assert replica_set.sticky_reads == 0 and replica.reads == 1
+
+
+def test_lagging_replica_falls_back_to_primary(client, use_replicas, test_posts):
+    keyword, posts = test_posts
+    replica_set = use_replicas(TEST_DATABASE)
+    replica, = replica_set.replicas
+    replica.lag, replica.checked_at = 60.0, time.monotonic()
+
+    assert client.get(f"/posts/{posts[0]['id']}").status_code == 200
+    assert replica.reads == 0 and replica_set.fallback_reads == 1
+
+
+def test_failed_replica_is_skipped(client, use_replicas, test_posts):
+    keyword, posts = test_posts
+    # nothing listens on port 1
+    replica_set = use_replicas("127.0.0.1:1", TEST_DATABASE)
+    down, up = replica_set.replicas
+
+    for i in range(3):
+        assert client.get(f"/posts/{posts[0]['id']}").status_code == 200
+    assert down.error is not None and down.reads == 0
+    assert up.reads == 3 and replica_set.fallback_reads == 0
+
+    up.lag = 60.0
+    assert client.get("/posts").status_code == 200
+    assert replica_set.fallback_reads == 1
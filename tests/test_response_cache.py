@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from app.config import settings
+from app.response_cache import RedisBackend, ResponseCache
+
+
+cache_enabled = pytest.mark.skipif(settings.response_cache_backend == "none",
+                                   reason="the response cache is switched off")
+
+
+@cache_enabled
+def test_get_post_is_cached_until_changed(client, test_posts, auth_headers):
+    keyword, posts = test_posts
+    post_id = posts[0]["id"]
+
+    first = client.get(f"/posts/{post_id}")
+    second = client.get(f"/posts/{post_id}")
+    assert second.json() == first.json()
+    assert second.headers["X-Query-Count"] == "0"
+
+    res = client.put(f"/posts/{post_id}", json={"title": "edited", "content": "edited"}, headers=auth_headers)
+    assert res.status_code == 200
+    assert client.get(f"/posts/{post_id}").json()["Post"]["title"] == "edited"
+
+
+@cache_enabled
+def test_get_posts_page_is_dropped_by_a_write(client, test_posts, auth_headers):
+    keyword, posts = test_posts
+    params = {"limit": 3, "search_keyword": keyword}
+    first = client.get("/posts", params=params)
+    cached = client.get("/posts", params=params)
+    assert cached.headers["X-Query-Count"] == "0"
+    assert cached.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+
+    res = client.post("/posts", json={"title": f"{keyword} newest", "content": "new"}, headers=auth_headers)
+    assert res.status_code == 201
+    assert client.get("/posts", params=params).json()[0]["Post"]["id"] == res.json()["id"]
+
+
+# Local stand-in for a Redis server (the subset of the redis.asyncio API used by the backend)
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+
+def test_redis_backend():
+    cache = ResponseCache(RedisBackend(FakeRedis()), ttl=10)
+    token = {"access_token": "abc", "token_type": "bearer"}
+
+    async def scenario():
+        key = await cache.posts_key(5, None, None, "")
+        assert await cache.get(key) is None
+        await cache.set(key, [token], {"X-Next-Cursor": "next"})
+        hit = await cache.get(key)
+        assert hit.body == b'[{"access_token":"abc","token_type":"bearer"}]'
+        assert hit.headers["X-Next-Cursor"] == "next"
+        await cache.post_changed(1)
+        assert await cache.posts_key(5, None, None, "") != key
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
@@ -0,0 +1,31 @@
+from app import models, search
+
+
+def test_inverted_index_ranking():
+    index = search.InvertedIndex()
+    index.add(1, "Python tips", "some python and some fastapi")
+    index.add(2, "Cooking", "python is also a snake")
+    index.add(3, "FastAPI", "nothing else")
+
+    assert [post_id for post_id, score in index.search("python", 10)] == [1, 2]
+    # every word of the query needs to be in the post
+    assert [post_id for post_id, score in index.search("Python FastAPI", 10)] == [1]
+
+    index.add(2, "Cooking", "no snakes anymore")
+    index.remove(1)
+    assert index.search("python", 10) == []
+
+
+def test_memory_search_against_sqlite(sqlite_db):
+    owner = sqlite_db.query(models.User).first()
+    sqlite_db.add_all([
+        models.Post(title="Indexes in Postgres", content="GIN and GiST", owner_id=owner.id),
+        models.Post(title="Gardening", content="postgres is not a plant", owner_id=owner.id),
+    ])
+    sqlite_db.commit()
+
+    search.index.clear()
+    results = search.search_posts(sqlite_db, "postgres", 10)
+    assert [post.title for post, rank in results] == ["Indexes in Postgres", "Gardening"]
+    assert results[0][0].owner.email == "sqlite@email.com"
+    search.index.clear()
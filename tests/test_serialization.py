@@ -0,0 +1,25 @@
+import json
+from fastapi.encoders import jsonable_encoder
+from app import models, schemas
+from app.serialization import dump, render
+
+
+# the fast path must give exactly the same JSON as the pydantic one
+def test_dump_matches_pydantic(sqlite_db):
+    user = sqlite_db.query(models.User).first()
+    post = models.Post(title="title", content="content", owner_id=user.id)
+    sqlite_db.add(post)
+    sqlite_db.commit()
+    sqlite_db.refresh(post)
+    row = sqlite_db.query(models.Post, models.Post.vote_count.label("votes")).first()
+
+    expected = jsonable_encoder(schemas.PostVoteStructure.from_orm(row))
+    data = dump(schemas.PostVoteStructure, row)
+    assert "password" not in data["Post"]["owner"]
+    assert json.loads(render(data)) == json.loads(json.dumps(expected))
+
+
+def test_users_are_served_with_orjson(client, post_user):
+    res = client.get(f"/users/{post_user['id']}")
+    assert res.status_code == 200
+    assert res.json() == {key: post_user[key] for key in ("id", "email", "name", "created_at")}
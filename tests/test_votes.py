@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from app import models, votes
+from app.database import SessionLocal
+from app.reconcile import reconcile_vote_counts
+from app.routers.auth import create_access_token
+
+
+def test_vote_count_follows_votes(client, make_user, test_posts):
+    keyword, posts = test_posts
+    post_id = posts[0]["id"]
+    voters = [make_user() for i in range(2)]
+    headers = [{"Authorization": f"Bearer {create_access_token({'user_id': voter['id']})}"}
+               for voter in voters]
+
+    for header in headers:
+        res = client.post("/votes", json={"post_id": post_id, "dir": 1}, headers=header)
+        assert res.status_code == 201
+    assert client.get(f"/posts/{post_id}").json()["votes"] == 2
+
+    res = client.post("/votes", json={"post_id": post_id, "dir": 0}, headers=headers[0])
+    assert res.status_code == 201
+    assert client.get(f"/posts/{post_id}").json()["votes"] == 1
+
+
+def test_reconcile_vote_counts(sqlite_db):
+    owner = sqlite_db.query(models.User).first()
+    post = models.Post(title="drift", content="drift", owner_id=owner.id)
+    sqlite_db.add(post)
+    sqlite_db.commit()
+    # a vote written behind the back of cast_vote
+    sqlite_db.add(models.Vote(user_id=owner.id, post_id=post.id))
+    sqlite_db.commit()
+    assert post.vote_count == 0
+
+    assert reconcile_vote_counts(sqlite_db) == 1
+    sqlite_db.refresh(post)
+    assert post.vote_count == 1
+    assert reconcile_vote_counts(sqlite_db) == 0
+
+
+# the SQLite stand-in of the load test can not run the single-statement votes (RETURNING)
+def test_votes_on_sqlite(sqlite_db):
+    owner = sqlite_db.query(models.User).first()
+    post = models.Post(title="sqlite", content="sqlite", owner_id=owner.id)
+    sqlite_db.add(post)
+    sqlite_db.commit()
+
+    assert votes.cast_vote(sqlite_db, owner.id, post.id, 1)[0] == 201
+    assert votes.cast_vote(sqlite_db, owner.id, post.id, 1)[0] == 409
+    assert votes.cast_vote(sqlite_db, owner.id, 0, 1)[0] == 404
+    assert votes.cast_vote(sqlite_db, owner.id, post.id, 0)[0] == 201
+    assert votes.cast_vote(sqlite_db, owner.id, post.id, 0) == (404, votes.NO_VOTE)
+
+    results, changed = votes.apply_votes(sqlite_db, [(owner.id, post.id, 1), (owner.id, post.id, 1), (owner.id, 0, 1)])
+    assert [code for code, detail in results] == [201, 409, 404] and changed == {post.id}
+    sqlite_db.refresh(post)
+    assert post.vote_count == 1
+    results, changed = votes.apply_votes(sqlite_db, [(owner.id, post.id, 0)])
+    sqlite_db.refresh(post)
+    assert post.vote_count == 0
+
+
+def test_bulk_create_posts(client, auth_headers, post_user):
+    items = [{"title": f"bulk {i}", "content": "bulk"} for i in range(5)]
+    res = client.post("/posts/bulk", json=items, headers=auth_headers)
+    assert res.status_code == 201
+    results = res.json()
+    assert [result["index"] for result in results] == list(range(5))
+    assert [result["post"]["title"] for result in results] == [item["title"] for item in items]
+    assert all(result["post"]["owner"]["id"] == post_user["id"] for result in results)
+    # one query to insert them all, one to write them into the feeds (the user comes from the cache or one lookup)
+    assert int(res.headers["X-Query-Count"]) <= 3
+
+    post_id = results[0]["post"]["id"]
+    assert client.get(f"/posts/{post_id}").json()["Post"]["title"] == "bulk 0"
+
+
+def test_batch_votes(client, auth_headers, test_posts):
+    keyword, posts = test_posts
+    first, second = posts[0]["id"], posts[1]["id"]
+    client.post("/votes", json={"post_id": second, "dir": 1}, headers=auth_headers)
+
+    res = client.post("/votes/batch", headers=auth_headers, json=[
+        {"post_id": first, "dir": 1},
+        {"post_id": first, "dir": 1},
+        {"post_id": second, "dir": 0},
+        {"post_id": 0, "dir": 1},
+        {"post_id": second, "dir": 0},
+    ])
+    assert res.status_code == 200
+    assert [result["status_code"] for result in res.json()] == [201, 409, 201, 404, 404]
+    assert client.get(f"/posts/{first}").json()["votes"] == 1
+    assert client.get(f"/posts/{second}").json()["votes"] == 0
+
+
+def test_single_vote_is_one_statement(client, auth_headers, test_posts):
+    keyword, posts = test_posts
+    post_id = posts[2]["id"]
+    client.get("/posts/0", headers=auth_headers)        # the current user is now in the cache
+
+    res = client.post("/votes", json={"post_id": post_id, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 201 and res.headers["X-Query-Count"] == "1"
+    res = client.post("/votes", json={"post_id": post_id, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 409
+    res = client.post("/votes", json={"post_id": post_id, "dir": 0}, headers=auth_headers)
+    assert res.status_code == 201 and res.headers["X-Query-Count"] == "1"
+    res = client.post("/votes", json={"post_id": post_id, "dir": 0}, headers=auth_headers)
+    assert res.status_code == 404 and res.json()["detail"] == "Vote does not exist"
+    res = client.post("/votes", json={"post_id": 0, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 404 and res.json()["detail"] == "Post 0 does not exist"
+
+
+# the same vote sent twice at the same time: one is counted, the other one is a conflict
+def test_concurrent_votes_are_counted_once(post_user, test_posts):
+    keyword, posts = test_posts
+    post_id = posts[3]["id"]
+    barrier = threading.Barrier(2)
+
+    def vote():
+        with SessionLocal() as db:
+            barrier.wait()
+            return votes.cast_vote(db, post_user["id"], post_id, 1)[0]
+
+    with ThreadPoolExecutor(2) as executor:
+        codes = sorted(executor.map(lambda i: vote(), range(2)))
+    assert codes == [201, 409]
+    with SessionLocal() as db:
+        assert db.get(models.Post, post_id).vote_count == 1
+
+
+def test_vote_buffer_coalesces_votes(make_user, test_posts):
+    keyword, posts = test_posts
+    post_id = posts[4]["id"]
+    voters = [make_user()["id"] for i in range(3)]
+    buffer = votes.VoteBuffer(delay_ms=50, max_size=100)
+
+    async def burst():
+        return await asyncio.gather(*[buffer.submit(voter, post_id, 1) for voter in voters],
+                                    buffer.submit(voters[0], post_id, 1), buffer.submit(voters[1], 0, 1))
+
+    # in the loop of the TestClient, the one of the asyncpg connections in the pool
+    results = asyncio.get_event_loop().run_until_complete(burst())
+    assert [code for code, detail in results] == [201, 201, 201, 409, 404]
+    assert buffer.flushes == 1 and buffer.votes == 5
+    with SessionLocal() as db:
+        assert db.get(models.Post, post_id).vote_count == 3
+
+
+def test_vote_through_the_buffer(client, auth_headers, test_posts, monkeypatch):
+    keyword, posts = test_posts
+    post_id = posts[5]["id"]
+    monkeypatch.setattr(votes.vote_buffer, "delay", 0.01)
+    flushes = votes.vote_buffer.flushes
+
+    res = client.post("/votes", json={"post_id": post_id, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 201
+    res = client.post("/votes", json={"post_id": post_id, "dir": 1}, headers=auth_headers)
+    assert res.status_code == 409
+    assert votes.vote_buffer.flushes == flushes + 2
+    assert client.get(f"/posts/{post_id}").json()["votes"] == 1
+
+
+# a batch which fails as a whole (here a made-up serialization failure) is written again vote by vote
+def test_vote_buffer_falls_back_to_single_votes(make_user, test_posts, monkeypatch):
+    keyword, posts = test_posts
+    post_id = posts[6]["id"]
+    voter = make_user()["id"]
+    buffer = votes.VoteBuffer(delay_ms=50, max_size=100)
+
+    def failing_batch(db, batch):
+        db.execute(select(1))
+        raise OperationalError("UPDATE posts ...", {}, Exception("could not serialize access"))
+
+    monkeypatch.setattr(votes, "apply_votes", failing_batch)
+
+    async def burst():
+        return await asyncio.gather(buffer.submit(voter, post_id, 1), buffer.submit(voter, 0, 1),
+                                    buffer.submit(voter, post_id, 1))
+
+    results = asyncio.get_event_loop().run_until_complete(burst())
+    assert [code for code, detail in results] == [201, 404, 409]
+    with SessionLocal() as db:
+        assert db.get(models.Post, post_id).vote_count == 1